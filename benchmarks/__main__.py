@@ -0,0 +1,107 @@
+"""
+offline benchmark suite, every pool size runs in a process of its own so
+peak rss is its own, results are appended to benchmarks/results/suite.jsonl
+and compared with the last run of the same storage and size
+
+    python -m benchmarks
+    python -m benchmarks --sizes 1000,10000
+    STORAGE=redis python -m benchmarks
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import dirname, exists, join
+from typing import List, Optional
+
+import click
+
+RESULTS = join(dirname(__file__), "results", "suite.jsonl")
+
+# name of result, unit, and if higher is better
+FIELDS = [
+    ("tester_proxies_per_second", "/s", True),
+    ("tester_pass_rate", "", True),
+    ("getter_cycle_seconds", "s", False),
+    ("random_p50_ms", "ms", False),
+    ("random_p99_ms", "ms", False),
+    ("all_p50_ms", "ms", False),
+    ("peak_rss_mb", "MB", False),
+]
+
+
+def load(path: str) -> List[dict]:
+    if not exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def commit() -> Optional[str]:
+    """
+    short hash of HEAD, None out of a git checkout
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(record: dict, last: Optional[dict]) -> None:
+    click.echo(f"pool size {record['size']} ({record['storage']}):")
+    for name, unit, higher in FIELDS:
+        line = f"  {name:<27}{record[name]:>12.3f}{unit}"
+        if last and last.get(name):
+            change = (record[name] - last[name]) / last[name] * 100
+            worse = change < 0 if higher else change > 0
+            line += f"  {change:+.1f}%{' worse' if worse and abs(change) >= 5 else ''}"
+        click.echo(line)
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="1000,10000,50000",
+    show_default=True,
+    help="comma separated pool sizes",
+)
+@click.option(
+    "--output", default=RESULTS, show_default=True, help="jsonl file of results"
+)
+def main(sizes, output):
+    """
+    run benchmarks at every pool size and record results
+    """
+    history = load(output)
+    os.makedirs(dirname(output), exist_ok=True)
+    revision = commit()
+    for size in map(int, sizes.split(",")):
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.suite", str(size)],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        record = json.loads(result.stdout.strip().splitlines()[-1])
+        record.update(time=time.strftime("%Y-%m-%dT%H:%M:%S"), commit=revision)
+        last = next(
+            (
+                item
+                for item in reversed(history)
+                if item["storage"] == record["storage"] and item["size"] == size
+            ),
+            None,
+        )
+        report(record, last)
+        with open(output, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+cpu time of converting 50k entries read from redis into proxies
+
+    python -m benchmarks.bench_convert
+"""
+import timeit
+
+import benchmarks.common  # noqa: F401
+from proxypool.utils.proxy import convert_proxies, filter_valid_proxies, is_valid_proxy
+
+ENTRIES = 50000
+REPEAT = 5
+
+DATA = [
+    (f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{8000 + i % 1000}", 1.7e9 + i)
+    for i in range(ENTRIES)
+]
+PROXIES = convert_proxies(DATA, trusted=True)
+
+CASES = {
+    "is_valid_proxy each": lambda: [
+        is_valid_proxy(proxy.string()) for proxy in PROXIES if proxy.expire
+    ],
+    "filter_valid_proxies": lambda: filter_valid_proxies(PROXIES),
+    "convert_proxies": lambda: convert_proxies(DATA),
+    "convert_proxies trusted": lambda: convert_proxies(DATA, trusted=True),
+}
+
+
+def main():
+    for name, case in CASES.items():
+        best = min(timeit.repeat(case, number=1, repeat=REPEAT))
+        print(f"{name:<24} {ENTRIES} entries: {best * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
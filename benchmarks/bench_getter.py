@@ -0,0 +1,65 @@
+"""
+getter cycle time against local slow sources, crawlers one after another
+with a client per url as getter used to do versus all of them concurrently
+with a shared client
+
+    python -m benchmarks.bench_getter
+"""
+import asyncio
+import time
+from typing import List
+
+from benchmarks.common import stub_source
+from proxypool.crawlers import FatezeroCrawler  # type: ignore
+from proxypool.processors.getter import Getter
+
+SOURCES = 5
+PAGES = 4
+LATENCY = 0.5
+
+
+def stub_crawlers(url: str) -> List[FatezeroCrawler]:
+    """
+    new crawlers for each run, so that no run sees sources or validators
+    cached by the one before
+    :param url: url of stub source
+    :return: crawlers
+    """
+    return [
+        type(
+            f"StubCrawler{i}",
+            (FatezeroCrawler,),
+            {"urls": [f"{url}/{i}/{page}" for page in range(PAGES)]},
+        )()
+        for i in range(SOURCES)
+    ]
+
+
+async def main():
+    getter = Getter()
+    async with stub_source(latency=LATENCY) as url:
+        getter.crawlers = stub_crawlers(url)
+        start = time.perf_counter()
+        for crawler in getter.crawlers:
+            async for proxy_list in crawler:
+                await getter.save(proxy_list)
+        sequential = time.perf_counter() - start
+
+        # same empty pool as the sequential run started with
+        await getter.storage.clear()
+        getter.crawlers = stub_crawlers(url)
+        start = time.perf_counter()
+        await getter.run()
+        concurrent = time.perf_counter() - start
+        await getter.close()
+
+    await getter.storage.clear()
+    print(
+        f"{SOURCES} sources x {PAGES} pages, {LATENCY}s latency each page:\n"
+        f"sequential: {sequential:.2f}s\n"
+        f"concurrent: {concurrent:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+"""
+latency of /random at different pool sizes
+
+    python -m benchmarks.bench_random
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from benchmarks.common import make_proxies, serve, summary
+from proxypool.processors.server import app, get_conn
+
+POOL_SIZES = [1000, 10000, 50000]
+REQUESTS = 1000
+
+
+async def main():
+    storage = get_conn()
+    async with serve(app) as url, aiohttp.ClientSession() as session:
+        for size in POOL_SIZES:
+            await storage.clear()
+            proxies = make_proxies(size)
+            await storage.batch_add(proxies)
+            durations = []
+            for _ in range(REQUESTS):
+                start = time.perf_counter()
+                async with session.get(f"{url}/random") as response:
+                    await response.text()
+                durations.append(time.perf_counter() - start)
+            print(f"/random pool size {size:>6}: {summary(durations)}")
+        await storage.clear()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""
+proxies tested per second against local stub proxies, one session per proxy
+as tester used to do versus the session shared by a whole cycle
+
+    python -m benchmarks.bench_tester
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from benchmarks.common import stub_proxies
+from proxypool.processors.tester import Tester
+from proxypool.setting import MAX_WORKERS, TEST_TIMEOUT, TEST_URL
+
+STUB_PROXIES = 200
+ROUNDS = 10
+
+
+async def per_proxy_session(proxy, sem):
+    async with sem:
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(ssl=False)
+        ) as session:
+            async with session.get(
+                TEST_URL,
+                proxy=f"http://{proxy.string()}",
+                timeout=TEST_TIMEOUT,
+                allow_redirects=False,
+            ) as response:
+                await response.read()
+
+
+async def main():
+    tester = Tester()
+    async with stub_proxies(STUB_PROXIES) as proxies:
+        proxies = proxies * ROUNDS
+        sem = asyncio.Semaphore(MAX_WORKERS)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(per_proxy_session(proxy, sem) for proxy in proxies))
+        before = len(proxies) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+
+        async def test(proxy, session):
+            async with sem:
+                await tester.test(proxy, session)
+
+        async with tester.build_session() as session:
+            await asyncio.gather(*(test(proxy, session) for proxy in proxies))
+        after = len(proxies) / (time.perf_counter() - start)
+
+    print(f"session per proxy: {before:.0f} proxies/s")
+    print(f"shared session:    {after:.0f} proxies/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
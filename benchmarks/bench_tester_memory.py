@@ -0,0 +1,44 @@
+"""
+peak rss of one tester cycle at different pool sizes, proxies point to
+closed local ports so every test fails at once
+
+    python -m benchmarks.bench_tester_memory
+"""
+import asyncio
+import resource
+import subprocess
+import sys
+
+from benchmarks.common import make_proxies
+from proxypool.processors.tester import Tester
+from proxypool.storages import get_storage
+
+POOL_SIZES = [1000, 10000, 50000]
+
+
+async def cycle(size: int) -> None:
+    storage = get_storage()
+    await storage.clear()
+    await storage.batch_add(make_proxies(size, network=127))
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    await Tester(storage).run()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    await storage.clear()
+    print(f"peak rss {peak / 1024:.1f}MB, {(peak - before) / 1024:.1f}MB by cycle")
+
+
+def main():
+    # peak rss never goes down, so every cycle runs in its own process
+    for size in POOL_SIZES:
+        print(f"tester pool size {size:>6}: ", end="", flush=True)
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_tester_memory", str(size)],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        asyncio.run(cycle(int(sys.argv[1])))
+    else:
+        main()
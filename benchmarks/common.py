@@ -0,0 +1,202 @@
+"""
+shared helpers of benchmarks, run them from the root of the project, e.g.
+
+    python -m benchmarks.bench_random
+
+benchmarks need no network, they run against the memory storage unless
+STORAGE=redis is set, then they write into their own redis key so a running
+pool is not touched
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+from random import random
+from typing import AsyncIterator, Callable, Dict, List
+
+os.environ.setdefault("STORAGE", "memory")
+os.environ.setdefault("PROXYPOOL_REDIS_KEY", "proxies:benchmark")
+# stub proxies answer any url, the host of it is never resolved
+os.environ.setdefault("TEST_URL", "http://stub.benchmark/")
+os.environ.setdefault("TEST_ANONYMOUS", "false")
+
+import uvicorn  # noqa: E402
+from aiohttp import web  # noqa: E402
+from loguru import logger  # noqa: E402
+
+import proxypool.setting  # noqa: E402, F401
+from proxypool.schemas import Proxy  # noqa: E402
+
+# per proxy debug logs would dominate the timings
+logger.remove()
+logger.add(sys.stderr, level=os.environ.get("BENCHMARK_LOG_LEVEL", "WARNING"))
+
+BENCHMARK_HOST = "127.0.0.1"
+BENCHMARK_PORT = int(os.environ.get("BENCHMARK_PORT", 5560))
+
+
+def make_proxies(
+    number: int, ttl: int = 3600, network: int = 10, start: int = 0
+) -> List[Proxy]:
+    """
+    build number of distinct fake proxies
+    :param number: number of proxies
+    :param ttl: seconds before proxies expire
+    :param network: first octet of hosts, 127 makes connections refused at once
+    :param start: index of the first proxy, proxies of other starts differ
+    :return: list of proxies
+    """
+    expire = int(time.time()) + ttl
+    return [
+        Proxy(
+            host=f"{network}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+            port=8000 + i % 1000,
+            expire=expire,
+        )
+        for i in range(start, start + number)
+    ]
+
+
+def percentile(durations: List[float], ratio: float) -> float:
+    """
+    value below which ratio of durations fall
+    """
+    durations = sorted(durations)
+    return durations[min(len(durations) - 1, int(len(durations) * ratio))]
+
+
+def summary(durations: List[float]) -> str:
+    """
+    format durations(seconds) as milliseconds percentiles
+    """
+    p99 = percentile(durations, 0.99)
+    return (
+        f"mean {statistics.mean(durations) * 1000:.3f}ms "
+        f"p50 {statistics.median(durations) * 1000:.3f}ms "
+        f"p99 {p99 * 1000:.3f}ms"
+    )
+
+
+@asynccontextmanager
+async def serve(app: Callable, port: int = BENCHMARK_PORT) -> AsyncIterator[str]:
+    """
+    run asgi app in the current loop
+    :return: base url of the app
+    """
+    server = uvicorn.Server(
+        uvicorn.Config(app, host=BENCHMARK_HOST, port=port, log_level="warning")
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://{BENCHMARK_HOST}:{port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+@asynccontextmanager
+async def stub_proxies(
+    number: int,
+    latency: float = 0.0,
+    failure_rate: float = 0.0,
+    host: str = BENCHMARK_HOST,
+) -> AsyncIterator[List[Proxy]]:
+    """
+    run number of local http proxies, each one answers requests itself
+    :param number: number of proxies
+    :param latency: seconds slept before answering
+    :param failure_rate: ratio of requests answered with 503
+    :param host: address to listen on
+    :return: list of proxies
+    """
+
+    async def handle(request: web.Request) -> web.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        if failure_rate and random() < failure_rate:
+            return web.Response(status=503)
+        return web.json_response({"origin": BENCHMARK_HOST})
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    proxies = []
+    expire = int(time.time()) + 3600
+    for _ in range(number):
+        site = web.TCPSite(runner, host, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        proxies.append(Proxy(host=BENCHMARK_HOST, port=port, expire=expire))
+    try:
+        yield proxies
+    finally:
+        await runner.cleanup()
+
+
+@asynccontextmanager
+async def stub_pool(
+    size: int, ports: int = 100, latency: float = 0.0, failure_rate: float = 0.0
+) -> AsyncIterator[List[Proxy]]:
+    """
+    run a few local http proxies listening on all addresses, and spread size
+    distinct proxies over them with hosts across 127.0.0.0/8, which all
+    reach the local listeners
+    :param size: number of proxies
+    :param ports: number of listeners
+    :param latency: seconds slept before answering
+    :param failure_rate: ratio of requests answered with 503
+    :return: list of proxies
+    """
+    async with stub_proxies(ports, latency, failure_rate, host="0.0.0.0") as fleet:
+        expire = int(time.time()) + 3600
+        yield [
+            Proxy(
+                host=f"127.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                port=fleet[i % ports].port,
+                expire=expire,
+            )
+            for i in range(size)
+        ]
+
+
+@asynccontextmanager
+async def stub_source(
+    latency: float = 0.0, proxies_per_page: int = 100
+) -> AsyncIterator[str]:
+    """
+    run a local proxy list serving fatezero style pages at /<anything>,
+    one json proxy per line, every path has its own proxies
+    :param latency: seconds slept before answering
+    :param proxies_per_page: number of proxies of a page
+    :return: base url of the source
+    """
+    pages: Dict[str, str] = {}
+
+    async def handle(request: web.Request) -> web.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        if request.path not in pages:
+            offset = len(pages) * proxies_per_page
+            pages[request.path] = "\n".join(
+                json.dumps({"host": proxy.host, "port": proxy.port})
+                for proxy in make_proxies(proxies_per_page, start=offset)
+            )
+        return web.Response(text=pages[request.path])
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, BENCHMARK_HOST, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    try:
+        yield f"http://{BENCHMARK_HOST}:{port}"
+    finally:
+        await runner.cleanup()
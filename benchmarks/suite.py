@@ -0,0 +1,115 @@
+"""
+end-to-end benchmarks of one pool size, run by python -m benchmarks in a
+process of its own, prints one json record
+
+    python -m benchmarks.suite 10000
+"""
+import asyncio
+import json
+import math
+import resource
+import sys
+import time
+
+import aiohttp
+
+from benchmarks.common import make_proxies, percentile, serve, stub_pool, stub_source
+from proxypool.crawlers import FatezeroCrawler  # type: ignore
+from proxypool.processors.getter import Getter
+from proxypool.processors.server import app, get_conn
+from proxypool.processors.tester import Tester
+from proxypool.setting import STORAGE
+from proxypool.storages.base import BaseStorage
+
+# stub proxies answer after a latency, some of them with 503
+STUB_PORTS = 100
+PROXY_LATENCY = 0.005
+FAILURE_RATE = 0.1
+# stub sources, size proxies are spread over their pages
+SOURCES = 5
+PAGES = 4
+SOURCE_LATENCY = 0.05
+RANDOM_REQUESTS = 500
+ALL_REQUESTS = 5
+
+
+async def bench_tester(storage: BaseStorage, size: int) -> dict:
+    """
+    one tester cycle over size proxies
+    """
+    async with stub_pool(size, STUB_PORTS, PROXY_LATENCY, FAILURE_RATE) as proxies:
+        await storage.clear()
+        await storage.batch_add(proxies)
+        start = time.perf_counter()
+        await Tester(storage).run()
+        duration = time.perf_counter() - start
+    return {
+        "tester_proxies_per_second": size / duration,
+        "tester_pass_rate": await storage.count() / size,
+    }
+
+
+async def bench_getter(storage: BaseStorage, size: int) -> dict:
+    """
+    one getter cycle crawling size proxies from slow sources
+    """
+    await storage.clear()
+    proxies_per_page = math.ceil(size / (SOURCES * PAGES))
+    async with stub_source(SOURCE_LATENCY, proxies_per_page) as url:
+        getter = Getter(storage)
+        getter.crawlers = [
+            type(
+                f"StubCrawler{i}",
+                (FatezeroCrawler,),
+                {"urls": [f"{url}/{i}/{page}" for page in range(PAGES)]},
+            )()
+            for i in range(SOURCES)
+        ]
+        start = time.perf_counter()
+        await getter.run()
+        duration = time.perf_counter() - start
+        await getter.close()
+    return {"getter_cycle_seconds": duration}
+
+
+async def bench_api(storage: BaseStorage, size: int) -> dict:
+    """
+    latency of /random and the whole /all over http
+    """
+    await storage.clear()
+    await storage.batch_add(make_proxies(size))
+    async with serve(app) as url, aiohttp.ClientSession() as session:
+
+        async def request(path: str) -> float:
+            start = time.perf_counter()
+            async with session.get(f"{url}{path}") as response:
+                await response.read()
+            return time.perf_counter() - start
+
+        random = [await request("/random") for _ in range(RANDOM_REQUESTS)]
+        whole = [await request("/all") for _ in range(ALL_REQUESTS)]
+    return {
+        "random_p50_ms": percentile(random, 0.5) * 1000,
+        "random_p99_ms": percentile(random, 0.99) * 1000,
+        "all_p50_ms": percentile(whole, 0.5) * 1000,
+    }
+
+
+async def run(size: int) -> dict:
+    """
+    run all benchmarks of size against the storage of server
+    :param size: pool size
+    :return: record of results
+    """
+    storage = get_conn()
+    record = {"storage": STORAGE, "size": size}
+    record.update(await bench_tester(storage, size))
+    record.update(await bench_getter(storage, size))
+    record.update(await bench_api(storage, size))
+    await storage.clear()
+    record["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return record
+
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(int(sys.argv[1])))))
@@ -1,37 +1,230 @@
 import asyncio
-import logging
-from typing import List
+import hashlib
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Set
 
+import aiohttp
 from aiohttp_retry import RetryClient
 from fake_headers import Headers
 from loguru import logger
-from tenacity import before_log, retry, stop_after_attempt, wait_random
 
 from proxypool.schemas import Proxy
-from proxypool.setting import GET_TIMEOUT, RAISE_FOR_STATUS, RETRIES, RETRY_OPTION
+from proxypool.setting import (
+    CRAWLER_BATCH_SIZE,
+    CRAWLER_TIMEOUT,
+    CYCLE_GETTER,
+    DEDUCTION_EXPIRATION_TIME,
+    ENABLE_INCREMENTAL_CRAWL,
+    GET_DNS_CACHE_TTL,
+    GET_TIMEOUT,
+    GETTER_MAX_CONCURRENCY,
+    RAISE_FOR_STATUS,
+    RETRY_OPTION,
+)
+from proxypool.utils.metrics import FETCHES
+
+
+def build_client() -> RetryClient:
+    """
+    build pooled client with keep-alive and dns cache,
+    retries of RETRY_OPTION are the only retries of a request
+    :return: client
+    """
+    return RetryClient(
+        client_session=aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                ssl=False,
+                limit=GETTER_MAX_CONCURRENCY,
+                ttl_dns_cache=GET_DNS_CACHE_TTL,
+            )
+        ),
+        raise_for_status=RAISE_FOR_STATUS,
+        retry_options=RETRY_OPTION,
+    )
+
+
+class Source:
+    """
+    what a url returned last time, to fetch it conditionally and save only new proxies
+    """
+
+    __slots__ = ("etag", "last_modified", "digest", "proxies", "deadline")
+
+    def __init__(self) -> None:
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.digest: Optional[bytes] = None
+        self.proxies: Set[str] = set()
+        # proxies of url expire in storage from then on if not saved again
+        self.deadline = math.inf
+
+    def copy(self) -> "Source":
+        """
+        copy to be updated by a fetch, proxies are replaced, not changed in place
+        """
+        source = Source()
+        source.etag = self.etag
+        source.last_modified = self.last_modified
+        source.digest = self.digest
+        source.proxies = self.proxies
+        source.deadline = self.deadline
+        return source
+
+    def conditions(self) -> Dict[str, str]:
+        """
+        headers of conditional request
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def validate(self, headers: Mapping[str, str]) -> None:
+        """
+        keep validators of a 200 response
+        """
+        self.etag = headers.get("ETag")
+        self.last_modified = headers.get("Last-Modified")
+
+    def update(self, digest: bytes, proxies: Set[str], expire: float) -> None:
+        """
+        replace proxies with those of a changed response
+        :param digest: hash of response body
+        :param proxies: all proxies of response, ip:port
+        :param expire: earliest expire of them
+        """
+        self.digest = digest
+        self.proxies = proxies
+        self.deadline = expire - DEDUCTION_EXPIRATION_TIME
+
+    def stale(self, interval: float) -> bool:
+        """
+        if proxies of url would expire before next getter run, then url is
+        fetched and all of its proxies are saved again to extend their expire
+        :param interval: seconds until proxies of url are saved again at the latest
+        """
+        return time.time() + interval >= self.deadline
+
+
+def earliest(proxy_list: List[Proxy]) -> float:
+    """
+    earliest expire of proxies, inf if none of them has one
+    """
+    return min(
+        (proxy.expire for proxy in proxy_list if proxy.expire is not None),
+        default=math.inf,
+    )
 
 
 class BaseCrawler:
     urls: List[str] = []
+    # parse response line by line with parse_line instead of parse
+    stream: bool = False
+    # long-lived client shared by crawlers, set by getter
+    client: Optional[RetryClient] = None
+    # seconds between getter runs, set by getter
+    cycle: int = CYCLE_GETTER
+    _headers: Optional[dict] = None
+    _sources: Optional[Dict[str, Source]] = None
+    # copies of sources updated by fetches whose proxies are not saved yet
+    _pending: Optional[Dict[str, Source]] = None
 
-    # reraise True 返回原本异常
-    @retry(
-        stop=stop_after_attempt(RETRIES),
-        reraise=True,
-        wait=wait_random(min=1, max=3),
-        before=before_log(logger, logging.DEBUG),
-    )
-    async def fetch(self, url, **kwargs):
-        headers = Headers(headers=True).generate()
+    @property
+    def headers(self) -> dict:
+        """
+        fake headers, generated once for each crawler
+        """
+        if self._headers is None:
+            self._headers = Headers(headers=True).generate()
+        return self._headers
+
+    def source(self, url: str) -> Source:
+        """
+        source of url, a new one if it is stale or ENABLE_INCREMENTAL_CRAWL is off
+        """
+        if not ENABLE_INCREMENTAL_CRAWL:
+            return Source()
+        if self._sources is None:
+            self._sources = {}
+        source = self._sources.get(url)
+        # next run starts within cycle after this one, which may take up to
+        # CRAWLER_TIMEOUT, getter keeps its backoff within deadlines of sources
+        if source is None or source.stale(self.cycle + CRAWLER_TIMEOUT):
+            source = self._sources[url] = Source()
+        return source
+
+    def begin(self, url: str) -> Source:
+        """
+        start a fetch of url, the copy of its source returned is updated by the
+        fetch and replaces the source once its proxies are saved, see commit
+        """
+        if self._pending is None:
+            self._pending = {}
+        source = self._pending[url] = self.source(url).copy()
+        return source
+
+    def pending(self, url: str) -> Source:
+        """
+        copy of source of url updated by the fetch in progress
+        """
+        if self._pending and url in self._pending:
+            return self._pending[url]
+        return self.begin(url)
+
+    def commit(self, url: str) -> None:
+        """
+        keep what url returned, called once its proxies are saved, so a fetch
+        whose proxies failed to save is made in full again next time
+        """
+        source = self._pending.pop(url, None) if self._pending else None
+        if source is not None and self._sources is not None:
+            self._sources[url] = source
+
+    def deadline(self) -> float:
+        """
+        earliest time proxies of urls crawled before expire in storage,
+        inf if none is known
+        """
+        return min(
+            (source.deadline for source in (self._sources or {}).values()),
+            default=math.inf,
+        )
+
+    @asynccontextmanager
+    async def request(
+        self, url: str, **kwargs: Any
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        send request with the shared client, or a temporary one if not set
+        """
         kwargs.setdefault("timeout", GET_TIMEOUT)
-        kwargs.setdefault("verify_ssl", False)
-        kwargs.setdefault("headers", headers)
-        async with RetryClient(
-            raise_for_status=RAISE_FOR_STATUS, retry_options=RETRY_OPTION
-        ) as client:
-            async with client.get(url=url, **kwargs) as response:
-                if response.status == 200:
-                    return await response.text()
+        kwargs.setdefault("headers", self.headers)
+        if self.client:
+            async with self.client.get(url=url, **kwargs) as response:
+                yield response
+        else:
+            async with build_client() as client:
+                async with client.get(url=url, **kwargs) as response:
+                    yield response
+
+    async def fetch(self, url, **kwargs):
+        """
+        fetch url, conditionally if it was fetched before
+        :return: text, None if failed or not modified
+        """
+        source = self.begin(url)
+        kwargs.setdefault("headers", {**self.headers, **source.conditions()})
+        async with self.request(url, **kwargs) as response:
+            if response.status == 200:
+                source.validate(response.headers)
+                return await response.text()
+            if response.status == 304:
+                logger.info(f"{url} not modified")
+                FETCHES.labels("not_modified").inc()
 
     def start_urls(self):
         return self.urls
@@ -39,6 +232,12 @@ class BaseCrawler:
     def parse(self, html: str) -> List[Proxy]:
         raise NotImplementedError
 
+    def parse_line(self, line: str) -> Optional[Proxy]:
+        """
+        used for parse one line of response in stream mode
+        """
+        raise NotImplementedError
+
     def process(self, html: str) -> List[Proxy]:
         """
         used for parse html
@@ -47,16 +246,30 @@ class BaseCrawler:
 
     async def crawl(self, url):
         """
-        crawl main method
+        crawl main method, source of url is kept once returned proxies are
+        saved, see commit
         """
         try:
             logger.info(f"fetching {url}")
             html = await self.fetch(url)
             if not html:
                 return []
+            source = self.pending(url)
+            digest = hashlib.blake2b(html.encode(), digest_size=16).digest()
+            if digest == source.digest:
+                logger.info(f"{url} unchanged")
+                FETCHES.labels("unchanged").inc()
+                return []
+            FETCHES.labels("changed").inc()
             proxy_list = self.process(html)
-            logger.info(f"fetched proxy {proxy_list} from {url}")
-            return proxy_list
+            new = [
+                proxy for proxy in proxy_list if proxy.string() not in source.proxies
+            ]
+            source.update(
+                digest, {proxy.string() for proxy in proxy_list}, earliest(proxy_list)
+            )
+            logger.info(f"fetched {len(proxy_list)} proxies from {url}, {len(new)} new")
+            return new
         except asyncio.exceptions.TimeoutError:
             logger.error(
                 f"crawler {self} crawled proxy unsuccessfully, "
@@ -64,11 +277,63 @@ class BaseCrawler:
             )
             return []
 
+    async def crawl_stream(self, url: str) -> AsyncIterator[List[Proxy]]:
+        """
+        crawl in stream mode, proxies are yielded in batches of CRAWLER_BATCH_SIZE
+        while the response is still downloading, only those new since last fetch,
+        source of url is kept once all of them are saved, see commit
+        """
+        try:
+            logger.info(f"fetching {url} as stream")
+            source = self.begin(url)
+            headers = {**self.headers, **source.conditions()}
+            async with self.request(url, headers=headers) as response:
+                if response.status == 304:
+                    logger.info(f"{url} not modified")
+                    FETCHES.labels("not_modified").inc()
+                    return
+                if response.status != 200:
+                    return
+                # body is parsed while downloading, so it is hashed to tell if
+                # it changed but parsed anyway
+                digest = hashlib.blake2b(digest_size=16)
+                fetched: Set[str] = set()
+                expire = math.inf
+                proxy_list = []
+                async for line in response.content:
+                    digest.update(line)
+                    if proxy := self.parse_line(line.decode(errors="ignore")):
+                        member = proxy.string()
+                        fetched.add(member)
+                        if proxy.expire is not None:
+                            expire = min(expire, proxy.expire)
+                        if member not in source.proxies:
+                            proxy_list.append(proxy)
+                    if len(proxy_list) >= CRAWLER_BATCH_SIZE:
+                        logger.info(f"fetched {len(proxy_list)} new proxies from {url}")
+                        yield proxy_list
+                        proxy_list = []
+                if proxy_list:
+                    logger.info(f"fetched {len(proxy_list)} new proxies from {url}")
+                    yield proxy_list
+                changed = digest.digest() != source.digest
+                FETCHES.labels("changed" if changed else "unchanged").inc()
+                source.validate(response.headers)
+                source.update(digest.digest(), fetched, expire)
+        except asyncio.exceptions.TimeoutError:
+            logger.error(
+                f"crawler {self} crawled proxy unsuccessfully, "
+                "please check if target url is valid or network issue"
+            )
+
     def __aiter__(self):
         self.crawl_cursor = 0
         return self
 
     async def __anext__(self) -> List[Proxy]:
+        # proxies of the last url are handled once the next one is asked for
+        if self.crawl_cursor:
+            self.commit(self.urls[self.crawl_cursor - 1])
         if len(self.urls) == 0:
             self.urls = self.start_urls()
         if len(self.urls) == self.crawl_cursor:
@@ -13,21 +13,27 @@ class FatezeroCrawler(BaseCrawler):
     """
 
     urls = [BASE_URL]
+    # one json proxy per line
+    stream = True
 
     def parse(self, html):
         """
         parse html file to get proxies
         :return:
         """
-
-        hosts_ports = html.split("\n")
         proxy_list = []
-        for addr in hosts_ports:
-            if addr:
-                ip_address = json.loads(addr)
-                host = ip_address["host"]
-                port = ip_address["port"]
-                proxy_list.append(
-                    Proxy(host=host, port=port, expire=int(time.time()) + 60 * 3)
-                )
+        for addr in html.split("\n"):
+            if proxy := self.parse_line(addr):
+                proxy_list.append(proxy)
         return proxy_list
+
+    def parse_line(self, line):
+        """
+        parse one line to get proxy
+        :return:
+        """
+        if line.strip():
+            ip_address = json.loads(line)
+            host = ip_address["host"]
+            port = ip_address["port"]
+            return Proxy(host=host, port=port, expire=int(time.time()) + 60 * 3)
@@ -1,8 +1,29 @@
+import asyncio
+import math
+import time
+from typing import List, Optional
+
+from aiohttp_retry import RetryClient
 from loguru import logger
 
 from proxypool.crawlers import classes
-from proxypool.setting import PROXY_NUMBER_MAX
-from proxypool.storages.redis import RedisClient
+from proxypool.crawlers.base import BaseCrawler, build_client, earliest
+from proxypool.schemas import Proxy
+from proxypool.setting import (
+    CRAWLER_MAX_CONCURRENCY,
+    CRAWLER_TIMEOUT,
+    CYCLE_GETTER,
+    DEDUCTION_EXPIRATION_TIME,
+    ENABLE_STAGING,
+    GETTER_BACKOFF_MAX,
+    GETTER_COOLDOWN,
+    GETTER_MAX_CONCURRENCY,
+    PROXY_NUMBER_MAX,
+    PROXY_NUMBER_MIN,
+)
+from proxypool.storages import get_storage
+from proxypool.storages.base import LOW_EVENT, BaseStorage
+from proxypool.utils.metrics import CRAWLED, GETTER_CYCLE_SECONDS, INGESTED, POOL_SIZE
 
 
 class Getter:
@@ -10,33 +31,181 @@ class Getter:
     getter of proxypool
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        storage: Optional[BaseStorage] = None,
+        fresh: Optional[asyncio.Event] = None,
+    ):
         """
         init db and crawlers
+        :param storage: storage shared with others, a new one if not set
+        :param fresh: event of a tester in the same loop set when proxies are staged
         """
-        self.redis = RedisClient()
+        self.storage = storage or get_storage()
+        self.fresh = fresh
         self.crawlers_cls = classes
         self.crawlers = [crawler_cls() for crawler_cls in self.crawlers_cls]
+        # client shared by all crawlers, built in the running loop
+        self.client: Optional[RetryClient] = None
+        # live proxies at last run, factor of cycle while the pool is healthy,
+        # and event set when the pool drops below PROXY_NUMBER_MIN
+        self.count = 0
+        self.backoff = 1
+        self.low = asyncio.Event()
+        # earliest time proxies saved in last run expire in storage
+        self.deadline = math.inf
 
     async def is_full(self):
         """
         if proxypool if full
         return: bool
         """
-        return await self.redis.count() >= PROXY_NUMBER_MAX
+        self.count = await self.storage.count()
+        POOL_SIZE.set(self.count)
+        return self.count >= PROXY_NUMBER_MAX
+
+    async def save(self, proxy_list: List[Proxy]) -> None:
+        """
+        save crawled proxies, staged to be tested first if ENABLE_STAGING
+        :param proxy_list: List[Proxy]
+        :return:
+        """
+        self.deadline = min(
+            self.deadline, earliest(proxy_list) - DEDUCTION_EXPIRATION_TIME
+        )
+        if ENABLE_STAGING:
+            result = await self.storage.stage(proxy_list)
+            logger.info(f"stage {len(proxy_list)} proxies: {result}")
+            INGESTED.labels("staged").inc(result.added)
+            INGESTED.labels("updated").inc(result.updated)
+            INGESTED.labels("rejected").inc(result.rejected)
+            if self.fresh is not None and result.added:
+                self.fresh.set()
+            return
+        result = await self.storage.batch_add(proxy_list)
+        logger.info(f"batch_add {len(proxy_list)} proxies: {result}")
+        INGESTED.labels("added").inc(result.added)
+        INGESTED.labels("updated").inc(result.updated)
+        INGESTED.labels("rejected").inc(result.rejected)
+
+    async def run_crawler(self, crawler: BaseCrawler, sem: asyncio.Semaphore) -> None:
+        """
+        crawl urls of one crawler concurrently within its timeout budget
+        :param crawler: crawler
+        :param sem: semaphore shared by all crawlers
+        :return:
+        """
+        logger.info(f"crawler {crawler} to get proxy")
+        crawler_sem = asyncio.Semaphore(CRAWLER_MAX_CONCURRENCY)
+        crawled = CRAWLED.labels(type(crawler).__name__)
+
+        async def crawl(url):
+            # one broken url must not stop the others
+            with logger.catch():
+                async with crawler_sem, sem:
+                    if crawler.stream:
+                        # save batches while the response is still downloading
+                        async for proxy_list in crawler.crawl_stream(url):
+                            crawled.inc(len(proxy_list))
+                            await self.save(proxy_list)
+                        crawler.commit(url)
+                        return
+                    proxy_list = await crawler.crawl(url)
+                if proxy_list:
+                    crawled.inc(len(proxy_list))
+                    await self.save(proxy_list)
+                # a failed save leaves the url to be fetched in full next time
+                crawler.commit(url)
+
+        try:
+            async with asyncio.timeout(CRAWLER_TIMEOUT):
+                await asyncio.gather(*(crawl(url) for url in crawler.start_urls()))
+        except TimeoutError:
+            logger.error(f"crawler {crawler} timed out after {CRAWLER_TIMEOUT}s")
 
     @logger.catch
-    async def run(self):
+    async def run(self, cycle: int = CYCLE_GETTER) -> None:
         """
         run crawlers to get proxy
+        :param cycle: getter cycle, to tell when proxies must be saved again
         :return:
         """
         if await self.is_full():
             return
+        start = time.perf_counter()
+        self.deadline = math.inf
+        if self.client is None:
+            self.client = build_client()
         for crawler in self.crawlers:
-            logger.info(f"crawler {crawler} to get proxy")
-            async for proxy_list in crawler:
-                new_proxy_number = await self.redis.batch_add(proxy_list)
-                logger.info(
-                    f"batch_add {proxy_list=} number of new proxy: {new_proxy_number=}"
-                )
+            crawler.client = self.client
+            crawler.cycle = cycle
+        sem = asyncio.Semaphore(GETTER_MAX_CONCURRENCY)
+        await asyncio.gather(
+            *(self.run_crawler(crawler, sem) for crawler in self.crawlers)
+        )
+        GETTER_CYCLE_SECONDS.set(time.perf_counter() - start)
+
+    def delay(self, cycle: int) -> int:
+        """
+        seconds to next run, cycle if the pool is below PROXY_NUMBER_MIN,
+        otherwise doubled after each run up to GETTER_BACKOFF_MAX times, but
+        not beyond the time crawled proxies expire in storage, so that they
+        are saved again before, a run taking up to CRAWLER_TIMEOUT
+        :param cycle: getter cycle
+        :return: seconds
+        """
+        if self.count < PROXY_NUMBER_MIN:
+            self.backoff = 1
+            return cycle
+        delay = cycle * self.backoff
+        self.backoff = min(self.backoff * 2, GETTER_BACKOFF_MAX)
+        deadline = min(
+            [self.deadline, *(crawler.deadline() for crawler in self.crawlers)]
+        )
+        return int(max(cycle, min(delay, deadline - time.time() - CRAWLER_TIMEOUT)))
+
+    async def wait(self, cycle: int) -> None:
+        """
+        wait for next run, cut short if the pool drops below PROXY_NUMBER_MIN,
+        though not within GETTER_COOLDOWN, nor if it was below already
+        :param cycle: getter cycle
+        :return:
+        """
+        delay = self.delay(cycle)
+        logger.debug(f"pool has {self.count} proxies, next getter run in {delay}s")
+        self.low.clear()
+        if self.count < PROXY_NUMBER_MIN:
+            # low is published as long as the pool stays low, getter would run
+            # every GETTER_COOLDOWN instead of every cycle
+            await asyncio.sleep(delay)
+            return
+        cooldown = min(GETTER_COOLDOWN, delay)
+        await asyncio.sleep(cooldown)
+        try:
+            async with asyncio.timeout(delay - cooldown):
+                await self.low.wait()
+            logger.info("pool drained, run getter now")
+        except TimeoutError:
+            pass
+
+    async def watch(self) -> None:
+        """
+        set low when the pool drops below PROXY_NUMBER_MIN, until cancelled
+        :return:
+        """
+        while True:
+            with logger.catch():
+                async for event in self.storage.events():
+                    if event == LOW_EVENT:
+                        self.low.set()
+            # listening failed, e.g. redis restarted
+            await asyncio.sleep(GETTER_COOLDOWN)
+
+    async def close(self):
+        """
+        close client shared by crawlers
+        :return:
+        """
+        if self.client:
+            await self.client.close()
+            self.client = None
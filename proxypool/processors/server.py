@@ -1,23 +1,80 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Union
+
 import uvicorn
-from fastapi import FastAPI
+from attr import asdict
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from proxypool.exceptions import PoolEmptyException
+from proxypool.schemas import Report
+from proxypool.setting import (
+    API_HOST,
+    API_PAGE_MAX_LIMIT,
+    API_PORT,
+    API_RANDOM_MAX_COUNT,
+    API_THREADED,
+    ENABLE_SERVER_CACHE,
+    IS_DEV,
+    LEASE_MAX_TTL,
+    LEASE_TTL,
+    POOLS,
+    REPORT_MAX_SIZE,
+)
+from proxypool.storages import get_storage
+from proxypool.storages.base import BaseStorage
+from proxypool.storages.cache import ProxyCache
+from proxypool.utils.metrics import (
+    API_SECONDS,
+    CACHE_HITS,
+    CACHE_MISSES,
+    CACHE_REFRESH_SECONDS,
+    CACHE_SIZE,
+    CONTENT_TYPE,
+    POOL_SIZE,
+    render,
+)
+from proxypool.utils.proxy import convert_proxy
+
+
+class MetricsMiddleware:
+    """
+    observe latency of requests by path, unknown paths are put together
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # endpoint is set by router once a route matches
+            path = scope["path"] if "endpoint" in scope else "other"
+            API_SECONDS.labels(path).observe(time.perf_counter() - start)
 
-from proxypool.setting import API_HOST, API_PORT, API_THREADED, IS_DEV
-from proxypool.storages.redis import RedisClient
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 
 if IS_DEV:
     app.debug = True
 
 
 def build_conn():
-    redis = None
+    storage = None
 
     def inner():
-        nonlocal redis
-        if not redis:
-            redis = RedisClient()
-        return redis
+        nonlocal storage
+        if not storage:
+            storage = get_storage()
+        return storage
 
     return inner
 
@@ -25,6 +82,40 @@ def build_conn():
 get_conn = build_conn()
 
 
+def get_pool(name: Optional[str]) -> BaseStorage:
+    """
+    get storage of a named pool of POOLS
+    :param name: name of pool, the universal pool if not set
+    :return: storage
+    """
+    if name is None:
+        return get_conn()
+    if name not in POOLS:
+        raise HTTPException(404, f"unknown pool {name}")
+    return get_conn().pool(name)
+
+
+# snapshot of live proxies of this worker, built on startup, None if disabled
+cache: Optional[ProxyCache] = None
+
+
+@app.on_event("startup")
+async def start_cache() -> None:
+    """
+    keep the snapshot refreshed in background, storage is not touched before
+    the server starts, and a failed refresh is logged and tried again
+    """
+    global cache
+    if not ENABLE_SERVER_CACHE:
+        return
+    cache = snapshot = ProxyCache(get_conn())
+    CACHE_SIZE.set_function(lambda: len(snapshot.proxies))
+    CACHE_HITS.set_function(lambda: snapshot.hits)
+    CACHE_MISSES.set_function(lambda: snapshot.misses)
+    CACHE_REFRESH_SECONDS.set_function(lambda: snapshot.refresh_seconds)
+    app.state.cache_task = asyncio.create_task(snapshot.run())
+
+
 @app.get("/ping")
 async def index():
     """
@@ -35,37 +126,183 @@ async def index():
 
 
 @app.get("/random")
-async def get_proxy():
+async def get_proxy(
+    strategy: Literal["random", "fastest", "weighted"] = "random",
+    count: Optional[int] = Query(None, ge=1, le=API_RANDOM_MAX_COUNT),
+    min_ttl: int = Query(0, ge=0),
+    pool: Optional[str] = None,
+) -> Union[str, List[str]]:
     """
     get a random proxy
-    :return: get a random proxy
+    :param strategy: random, fastest or weighted by latency
+    :param count: get a list of distinct proxies instead of one
+    :param min_ttl: min seconds proxies must stay alive
+    :param pool: name of pool working for a target, universal pool if not set
+    :return: get a random proxy, or list of proxies if count is set
     """
-    conn = get_conn()
-    proxy = await conn.random()
+    conn = get_pool(pool)
+    if count or min_ttl:
+        proxies = await conn.sample(count or 1, min_ttl, strategy)
+        if not proxies:
+            raise PoolEmptyException
+        if count:
+            return [proxy.string() for proxy in proxies]
+        return proxies[0].string()
+    if cache and pool is None and strategy == "random" and (proxy := cache.random()):
+        return proxy.string()
+    proxy = await conn.random(strategy)
     return proxy.string()
 
 
 @app.get("/all")
-async def get_proxy_all():
+async def get_proxy_all(
+    limit: Optional[int] = Query(None, ge=1, le=API_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson", "text"] = "json",
+) -> Any:
     """
-    get a random proxy
-    :return: get a random proxy
+    get all proxies
+    :param limit: size of page, all proxies at once if not set
+    :param cursor: cursor returned with last page, first page if not set
+    :param format: json, or stream of json lines or host:port lines
+        read from storage in chunks, limit and cursor are ignored then
+    :return: all proxies, or a page {"proxies": [...], "cursor": next or null}
     """
     conn = get_conn()
+    if format != "json":
+        return StreamingResponse(
+            stream_proxies(format),
+            media_type="application/x-ndjson" if format == "ndjson" else "text/plain",
+        )
+    if limit:
+        try:
+            proxies, next_cursor = await conn.page(cursor, limit)
+        except ValueError:
+            raise HTTPException(400, f"invalid cursor {cursor}")
+        return {
+            "proxies": [asdict(proxy) for proxy in proxies],
+            "cursor": next_cursor,
+        }
     proxies = await conn.all()
-    return proxies
+    # slotted proxies have no __dict__ for fastapi to encode
+    return [asdict(proxy) for proxy in proxies]
+
+
+@app.post("/lease")
+async def lease_proxy(
+    ttl: int = Query(LEASE_TTL, ge=1, le=LEASE_MAX_TTL)
+) -> Dict[str, Union[str, int]]:
+    """
+    lease a proxy exclusively, it is released automatically after ttl
+    :param ttl: seconds of lease
+    :return: {"lease": id, "proxy": proxy, "expire": expire of lease},
+        503 if every proxy is leased or the pool is empty
+    """
+    conn = get_conn()
+    lease = await conn.checkout(ttl)
+    if not lease:
+        raise HTTPException(503, "no proxy to lease, try again later")
+    return {"lease": lease.id, "proxy": lease.proxy.string(), "expire": lease.expire}
+
+
+@app.post("/release")
+async def release_proxy(lease: str, success: Optional[bool] = None) -> Dict[str, bool]:
+    """
+    release a leased proxy
+    :param lease: id of lease
+    :param success: if the proxy worked, reported like /report, so a false
+        one counts as a failure and the proxy is removed at the threshold
+    :return: {"released": if lease existed}
+    """
+    conn = get_conn()
+    released = await conn.release(lease, success)
+    if released and success is False:
+        # proxy may have been removed, getter is woken if the pool drained
+        await conn.notify_low()
+    return {"released": released}
+
+
+class ProxyReport(BaseModel):
+    """
+    outcome of a proxy used by a client
+    """
+
+    proxy: str
+    success: bool
+    latency: Optional[float] = Field(None, ge=0)
+
+
+@app.post("/report")
+async def report_proxies(reports: List[ProxyReport]) -> Dict[str, int]:
+    """
+    report outcomes of proxies, proxies failed repeatedly are removed
+    :param reports: list of {"proxy": host:port, "success": bool, "latency": ms}
+    :return: {"applied": number of known proxies, "removed": number of removed
+        proxies, "rejected": number of invalid proxies}
+    """
+    if len(reports) > REPORT_MAX_SIZE:
+        raise HTTPException(413, f"at most {REPORT_MAX_SIZE} reports at once")
+    conn = get_conn()
+    result = await conn.report(
+        [
+            Report(
+                proxy=convert_proxy((report.proxy, 0)),
+                success=report.success,
+                latency=report.latency,
+            )
+            for report in reports
+        ]
+    )
+    if result.removed:
+        await conn.notify_low()
+    return asdict(result)
+
+
+async def stream_proxies(format: str) -> AsyncIterator[str]:
+    """
+    stream proxies chunk by chunk, memory does not grow with the pool
+    :param format: ndjson or text
+    :return: lines of proxies
+    """
+    async for proxies in get_conn().scan():
+        if format == "ndjson":
+            yield "".join(f"{json.dumps(asdict(proxy))}\n" for proxy in proxies)
+        else:
+            yield "".join(f"{proxy.string()}\n" for proxy in proxies)
 
 
 @app.get("/count")
-async def get_count():
+async def get_count(pool: Optional[str] = None) -> int:
     """
     get the count of proxies
+    :param pool: name of pool working for a target, universal pool if not set
     :return: count, int
     """
-    conn = get_conn()
+    if cache and pool is None and (count := cache.count()) is not None:
+        return count
+    conn = get_pool(pool)
     return int(await conn.count())
 
 
+@app.get("/cache")
+async def get_cache_stats():
+    """
+    get metrics of the snapshot cache
+    :return: stats, empty if cache disabled
+    """
+    return cache.stats() if cache else {}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    get metrics of this process in prometheus text format
+    :return: metrics
+    """
+    POOL_SIZE.set(await get_conn().count())
+    return Response(render(), headers={"Content-Type": CONTENT_TYPE})
+
+
 if __name__ == "__main__":
     uvicorn.run(
         app=app, host=API_HOST, port=API_PORT, reload=True, workers=API_THREADED
@@ -1,8 +1,11 @@
 import asyncio
+import time
 from asyncio import TimeoutError
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
 
 import aiohttp
 from aiohttp import (
+    ClientError,
     ClientHttpProxyError,
     ClientOSError,
     ClientProxyConnectionError,
@@ -12,13 +15,32 @@ from loguru import logger
 
 from proxypool.schemas import Proxy
 from proxypool.setting import (
+    ENABLE_TEST_SCHEDULE,
     MAX_WORKERS,
+    POOLS,
     TEST_ANONYMOUS,
+    TEST_ANONYMOUS_URL,
+    TEST_CONNECTOR_LIMIT,
+    TEST_DNS_CACHE_TTL,
+    TEST_FLUSH_INTERVAL,
+    TEST_FLUSH_SIZE,
+    TEST_FRESH_WORKERS,
+    TEST_KEEPALIVE_TIMEOUT,
+    TEST_ORIGIN_IP_TTL,
     TEST_TIMEOUT,
     TEST_URL,
     TEST_VALID_STATUS,
 )
-from proxypool.storages.redis import RedisClient
+from proxypool.storages import get_storage
+from proxypool.storages.base import BaseStorage
+from proxypool.utils.metrics import (
+    DELETED,
+    POOL_SIZE,
+    POOL_TESTS,
+    TEST_SECONDS,
+    TESTER_CYCLE_SECONDS,
+    TESTS,
+)
 
 EXCEPTIONS = (
     ClientProxyConnectionError,
@@ -30,75 +52,399 @@ EXCEPTIONS = (
     AssertionError,
 )
 
+# values of metrics updated by every test
+VALID_TESTS = TESTS.labels("valid")
+INVALID_TESTS = TESTS.labels("invalid")
+TEST_LATENCY = TEST_SECONDS.labels()
+
+
+class Target:
+    """
+    named pool tested against its own url, with its buffered results
+    """
+
+    def __init__(
+        self, name: str, storage: BaseStorage, url: str, status: List[int], cycle: int
+    ):
+        """
+        init target
+        :param name: name of pool
+        :param storage: storage of pool
+        :param url: test url of pool
+        :param status: valid status codes of url
+        :param cycle: seconds between two tests of proxies of pool
+        """
+        self.name = name
+        self.storage = storage
+        self.url = url
+        self.status = status
+        self.cycle = cycle
+        self.tested_at: Optional[float] = None
+        self.valid: List[Tuple[Proxy, float]] = []
+        self.invalid: List[Proxy] = []
+        self.valid_tests = POOL_TESTS.labels(name, "valid")
+        self.invalid_tests = POOL_TESTS.labels(name, "invalid")
+
+    def due(self, now: float) -> bool:
+        """
+        if proxies are due to be tested against url, marks them tested if so
+        :param now: monotonic time
+        :return: bool
+        """
+        if self.tested_at is not None and now - self.tested_at < self.cycle:
+            return False
+        self.tested_at = now
+        return True
+
+    async def flush(self) -> None:
+        """
+        write buffered results to storage of pool, passed proxies are added
+        with the expire they have in the universal pool
+        :return:
+        """
+        invalid, self.invalid = self.invalid, []
+        valid, self.valid = self.valid, []
+        if invalid:
+            await self.storage.batch_delete(invalid)
+        if valid:
+            await self.storage.batch_add([proxy for proxy, _ in valid], 0)
+            await self.storage.record(valid)
+
 
 class Tester:
     """
     tester for testing proxies in queue
     """
 
-    def __init__(self):
+    def __init__(self, storage: Optional[BaseStorage] = None):
         """
-        init redis
+        init storage
+        :param storage: storage shared with others, a new one if not set
         """
-        self.redis = RedisClient()
+        self.storage = storage or get_storage()
         self.loop = asyncio.get_event_loop()
+        # egress ip of ours, shared by all tests
+        self.origin_ip: Optional[str] = None
+        self.origin_ip_expire = 0.0
+        # invalid proxies waiting to be removed, valid ones waiting to be
+        # recorded with their latency and staged ones waiting to be promoted
+        self.invalid: List[Proxy] = []
+        self.valid: List[Tuple[Proxy, float]] = []
+        self.promoted: List[Tuple[Proxy, float]] = []
+        self.flushed_at = time.monotonic()
+        self.scheduled = False
+        # named pools, valid proxies are tested against those due in this cycle
+        self.targets = [
+            Target(name, self.storage.pool(name), **pool)
+            for name, pool in POOLS.items()
+        ]
+        self.due_targets: List[Target] = []
 
-    async def test(self, proxy: Proxy, sem: asyncio.Semaphore) -> None:
+    @staticmethod
+    def build_session() -> aiohttp.ClientSession:
+        """
+        build session shared by all tests of one cycle,
+        pooled connections are keyed by proxy so proxies never share one,
+        cookies are dropped so they can not leak from one proxy to another
+        :return: session
+        """
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                ssl=False,
+                limit=TEST_CONNECTOR_LIMIT,
+                ttl_dns_cache=TEST_DNS_CACHE_TTL,
+                keepalive_timeout=TEST_KEEPALIVE_TIMEOUT,
+            ),
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+
+    async def resolve_origin_ip(self, session: aiohttp.ClientSession) -> None:
+        """
+        resolve our egress ip without proxy, cached for TEST_ORIGIN_IP_TTL
+        keep the last known ip if it can not be resolved
+        :param session: shared session
+        :return:
+        """
+        if time.monotonic() < self.origin_ip_expire:
+            return
+        try:
+            async with session.get(
+                TEST_ANONYMOUS_URL, timeout=TEST_TIMEOUT
+            ) as response:
+                resp_json = await response.json()
+                self.origin_ip = resp_json["origin"]
+                self.origin_ip_expire = time.monotonic() + TEST_ORIGIN_IP_TTL
+                logger.debug(f"origin ip {self.origin_ip}")
+        except (ClientError, TimeoutError, KeyError, ValueError) as e:
+            logger.error(f"resolve origin ip unsuccessfully: {e!r}")
+
+    async def discard(self, proxy: Proxy, staged: bool = False) -> None:
+        """
+        buffer invalid proxy, flush when buffer is full or old enough,
+        a staged proxy is only dropped as it is not stored any more
+        :param proxy: Proxy object
+        :param staged: if proxy is popped from staging
+        :return:
+        """
+        logger.debug(f"proxy {proxy.string()} is invalid, delete")
+        INVALID_TESTS.inc()
+        if not staged:
+            self.invalid.append(proxy)
+            # a proxy dead for the test url is not kept for any target
+            for target in self.targets:
+                target.invalid.append(proxy)
+            await self.flush_if_needed()
+
+    async def keep(self, proxy: Proxy, latency: float, staged: bool = False) -> None:
+        """
+        buffer valid proxy to record its latency and schedule its next test,
+        a staged proxy is promoted to be served first
+        :param proxy: Proxy object
+        :param latency: latency of test url in ms
+        :param staged: if proxy is popped from staging
+        :return:
+        """
+        logger.debug(f"proxy {proxy.string()} is valid, latency {latency:.0f}ms")
+        VALID_TESTS.inc()
+        TEST_LATENCY.observe(latency / 1000)
+        (self.promoted if staged else self.valid).append((proxy, latency))
+        await self.flush_if_needed()
+
+    async def flush_if_needed(self) -> None:
+        """
+        flush when buffer is full or old enough
+        :return:
+        """
+        if (
+            len(self.invalid) + len(self.valid) + len(self.promoted) >= TEST_FLUSH_SIZE
+            or time.monotonic() - self.flushed_at >= TEST_FLUSH_INTERVAL
+        ):
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        write buffered results to storage
+        :return:
+        """
+        invalid, self.invalid = self.invalid, []
+        valid, self.valid = self.valid, []
+        promoted, self.promoted = self.promoted, []
+        self.flushed_at = time.monotonic()
+        if invalid:
+            deleted = await self.storage.batch_delete(invalid)
+            DELETED.labels("invalid").inc(deleted)
+            if deleted:
+                # getter is woken at once if the pool drained
+                await self.storage.notify_low()
+        if promoted:
+            # expire of staged proxies is deducted when they are staged
+            await self.storage.batch_add([proxy for proxy, _ in promoted], 0)
+            valid += promoted
+        if valid:
+            await self.storage.record(valid)
+            if ENABLE_TEST_SCHEDULE:
+                await self.storage.reschedule([proxy for proxy, _ in valid])
+        for target in self.targets:
+            await target.flush()
+
+    async def test(
+        self, proxy: Proxy, session: aiohttp.ClientSession, staged: bool = False
+    ) -> None:
         """
         test single proxy
         :param proxy: Proxy object
+        :param session: shared session
+        :param staged: if proxy is popped from staging
+        :return:
+        """
+        try:
+            logger.debug(f"testing {proxy.string()}")
+            # if TEST_ANONYMOUS is True, make sure that
+            # the proxy has the effect of hiding the real IP
+            if TEST_ANONYMOUS:
+                async with session.get(
+                    TEST_ANONYMOUS_URL,
+                    proxy=f"http://{proxy.string()}",
+                    timeout=TEST_TIMEOUT,
+                ) as response:
+                    resp_json = await response.json()
+                    anonymous_ip = resp_json["origin"]
+                assert self.origin_ip != anonymous_ip
+                assert proxy.host == anonymous_ip
+            start = time.perf_counter()
+            async with session.get(
+                TEST_URL,
+                proxy=f"http://{proxy.string()}",
+                timeout=TEST_TIMEOUT,
+                allow_redirects=False,
+            ) as response:
+                valid = response.status in TEST_VALID_STATUS
+                latency = (time.perf_counter() - start) * 1000
+        except EXCEPTIONS:
+            valid = False
+        if not valid:
+            await self.discard(proxy, staged)
+            return
+        await self.keep(proxy, latency, staged)
+        # staged proxies are new to every pool
+        targets = self.targets if staged else self.due_targets
+        if targets:
+            await self.test_targets(proxy, session, targets)
+
+    async def test_targets(
+        self, proxy: Proxy, session: aiohttp.ClientSession, targets: Sequence[Target]
+    ) -> None:
+        """
+        test valid proxy against url of pools one after another, so that a
+        keep-alive connection through the proxy is reused by the shared session
+        :param proxy: Proxy object
+        :param session: shared session
+        :param targets: pools to test against
         :return:
         """
-        async with sem:
-            async with aiohttp.ClientSession(
-                connector=aiohttp.TCPConnector(ssl=False)
-            ) as session:
+        for target in targets:
+            try:
+                start = time.perf_counter()
+                async with session.get(
+                    target.url,
+                    proxy=f"http://{proxy.string()}",
+                    timeout=TEST_TIMEOUT,
+                    allow_redirects=False,
+                ) as response:
+                    valid = response.status in target.status
+                    latency = (time.perf_counter() - start) * 1000
+            except EXCEPTIONS:
+                valid = False
+            if valid:
+                target.valid_tests.inc()
+                target.valid.append((proxy, latency))
+            else:
+                target.invalid_tests.inc()
+                target.invalid.append(proxy)
+
+    async def test_all(
+        self, *sources: Tuple[AsyncIterator[List[Proxy]], bool], workers: int
+    ) -> int:
+        """
+        test chunks of proxies from sources one after another with workers
+        sharing one session, buffered results are flushed at the end
+        :param sources: chunks of proxies, and if they are popped from staging
+        :param workers: number of concurrent tests
+        :return: number of tested proxies
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+        # staged proxies popped but not tested yet, staged again if test fails
+        untested: List[Proxy] = []
+
+        async def produce():
+            cancelled = False
+            try:
+                for chunks, staged in sources:
+                    async for proxies in chunks:
+                        for i, proxy in enumerate(proxies):
+                            try:
+                                await queue.put((proxy, staged))
+                            except asyncio.CancelledError:
+                                if staged:
+                                    untested.extend(proxies[i:])
+                                raise
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                # workers are cancelled as well, the queue may never drain
+                if not cancelled:
+                    for _ in range(workers):
+                        await queue.put(None)
+
+        async def consume(session: aiohttp.ClientSession) -> int:
+            tested = 0
+            while (item := await queue.get()) is not None:
+                proxy, staged = item
                 try:
-                    logger.debug(f"testing {proxy.string()}")
-                    # if TEST_ANONYMOUS is True, make sure that
-                    # the proxy has the effect of hiding the real IP
-                    if TEST_ANONYMOUS:
-                        url = "https://httpbin.org/ip"
-                        async with session.get(url, timeout=TEST_TIMEOUT) as response:
-                            resp_json = await response.json()
-                            origin_ip = resp_json["origin"]
-                        async with session.get(
-                            url, proxy=f"http://{proxy.string()}", timeout=TEST_TIMEOUT
-                        ) as response:
-                            resp_json = await response.json()
-                            anonymous_ip = resp_json["origin"]
-                        assert origin_ip != anonymous_ip
-                        assert proxy.host == anonymous_ip
-                    async with session.get(
-                        TEST_URL,
-                        proxy=f"http://{proxy.string()}",
-                        timeout=TEST_TIMEOUT,
-                        allow_redirects=False,
-                    ) as response:
-                        if response.status in TEST_VALID_STATUS:
-                            logger.debug(f"proxy {proxy.string()} is valid")
-                        else:
-                            await self.redis.delete(proxy)
-                            logger.debug(f"proxy {proxy.string()} is invalid, delete")
-                except EXCEPTIONS:
-                    await self.redis.delete(proxy)
-                    logger.debug(f"proxy {proxy.string()} is invalid, delete")
+                    # one unexpected error must not stop the worker
+                    with logger.catch():
+                        await self.test(proxy, session, staged)
+                except asyncio.CancelledError:
+                    if staged:
+                        untested.append(proxy)
+                    raise
+                tested += 1
+            return tested
+
+        async with self.build_session() as session:
+            if TEST_ANONYMOUS:
+                await self.resolve_origin_ip(session)
+            tasks = [
+                asyncio.create_task(produce()),
+                *(asyncio.create_task(consume(session)) for _ in range(workers)),
+            ]
+            try:
+                _, *tested = await asyncio.gather(*tasks)
+            except BaseException:
+                # cancelled or reading chunks failed, workers are stopped
+                # before the session is closed
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                while not queue.empty():
+                    if (item := queue.get_nowait()) and item[1]:
+                        untested.append(item[0])
+                await self.restage(untested)
+                raise
+        await self.flush()
+        return sum(tested)
+
+    async def restage(self, proxy_list: List[Proxy]) -> None:
+        """
+        stage popped proxies again and flush buffered results when a test is
+        cancelled or fails, so that they are not lost until they are crawled again
+        :param proxy_list: staged proxies not tested yet
+        """
+        with logger.catch():
+            if proxy_list:
+                # expire of staged proxies is already deducted
+                result = await self.storage.stage(proxy_list, 0)
+                logger.info(f"restaged untested proxies, {result}")
+            await self.flush()
 
     @logger.catch
     async def run(self):
         """
-        test main method
+        test main method, staged proxies first, then due proxies if scheduled,
+        otherwise all of them
         :return:
         """
-        # event loop of aiohttp
         logger.info("stating tester...")
-        semaphore = asyncio.Semaphore(MAX_WORKERS)
-        proxies = await self.redis.all()
-        logger.debug(f"testing proxies , count {len(proxies)}")
-        if proxies:
-            tasks = [
-                asyncio.create_task(self.test(proxy, semaphore)) for proxy in proxies
-            ]
-            await asyncio.wait(tasks)
+        start = time.perf_counter()
+        now = time.monotonic()
+        self.due_targets = [target for target in self.targets if target.due(now)]
+        if ENABLE_TEST_SCHEDULE and not self.scheduled:
+            await self.storage.schedule_all()
+            self.scheduled = True
+        chunks = self.storage.due() if ENABLE_TEST_SCHEDULE else self.storage.scan()
+        tested = await self.test_all(
+            (self.storage.staged(), True), (chunks, False), workers=MAX_WORKERS
+        )
+        logger.debug(f"tested proxies, count {tested}")
+
+        DELETED.labels("expired").inc(await self.storage.expired_delete())
+        for target in self.targets:
+            await target.storage.expired_delete()
+        POOL_SIZE.set(await self.storage.notify_low())
+        TESTER_CYCLE_SECONDS.set(time.perf_counter() - start)
 
-        await self.redis.expired_delete()
+    async def run_fresh(self, event: asyncio.Event) -> None:
+        """
+        test staged proxies as soon as getter sets event, until cancelled
+        :param event: set by getter when new proxies are staged
+        :return:
+        """
+        while True:
+            await event.wait()
+            event.clear()
+            with logger.catch():
+                tested = await self.test_all(
+                    (self.storage.staged(), True), workers=TEST_FRESH_WORKERS
+                )
+                logger.debug(f"tested fresh proxies, count {tested}")
@@ -1,4 +1,5 @@
 import asyncio
+from typing import Awaitable
 
 import click
 import uvicorn
@@ -14,14 +15,87 @@ from proxypool.setting import (
     CYCLE_TESTER,
     ENABLE_GETTER,
     ENABLE_SERVER,
+    ENABLE_STAGING,
     ENABLE_TESTER,
+    GETTER_METRICS_PORT,
     IS_PROD,
+    METRICS_HOST,
+    STORAGE,
+    TESTER_METRICS_PORT,
     WORKERS,
 )
+from proxypool.utils.metrics import start_metrics_server
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
 
+def check_storage(command: str) -> None:
+    """
+    exit if storage is not shared between processes, memory storage only
+    works with run-all
+    :param command: name of command
+    :return:
+    """
+    if STORAGE == "memory":
+        logger.error(
+            f"STORAGE=memory keeps proxies in one process, {command} would "
+            "have a pool of its own, use run-all instead"
+        )
+        raise SystemExit(1)
+
+
+async def with_metrics(main: Awaitable[None], port: int) -> None:
+    """
+    serve /metrics of this process on port while running main
+    :param main: coroutine to run
+    :param port: port of metrics, 0 to disable
+    :return:
+    """
+    runner = await start_metrics_server(METRICS_HOST, port) if port else None
+    try:
+        await main
+    finally:
+        if runner:
+            await runner.cleanup()
+
+
+async def tester_loop(tester: Tester, cycle: int) -> None:
+    """
+    run tester every cycle seconds
+    :param tester: tester
+    :param cycle: seconds between two runs
+    :return:
+    """
+    loop = 0
+    while True:
+        logger.debug(f"tester loop {loop} start...")
+        await tester.run()
+        loop += 1
+        await asyncio.sleep(cycle)
+
+
+async def getter_loop(getter: Getter, cycle: int) -> None:
+    """
+    run getter every cycle seconds, backed off while the pool is healthy and
+    at once when it drains, its client is closed when stopped
+    :param getter: getter
+    :param cycle: seconds between two runs
+    :return:
+    """
+    loop = 0
+    watch = asyncio.create_task(getter.watch())
+    try:
+        while True:
+            logger.debug(f"getter loop {loop} start...")
+            await getter.run(cycle)
+            loop += 1
+            await getter.wait(cycle)
+    finally:
+        watch.cancel()
+        await asyncio.gather(watch, return_exceptions=True)
+        await getter.close()
+
+
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.version_option(version="1.0.0")
 def cli():
@@ -48,17 +122,9 @@ def run_tester(cycle):
     if not ENABLE_TESTER:
         logger.info("tester not enabled, exit")
         return
+    check_storage("run-tester")
     tester = Tester()
-
-    async def inner():
-        loop = 0
-        while True:
-            logger.debug(f"getter loop {loop} start...")
-            await tester.run()
-            loop += 1
-            await asyncio.sleep(cycle)
-
-    asyncio.run(inner())
+    asyncio.run(with_metrics(tester_loop(tester, cycle), TESTER_METRICS_PORT))
 
 
 @cli.command()
@@ -78,17 +144,9 @@ def run_getter(cycle):
     if not ENABLE_GETTER:
         logger.info("getter not enabled, exit")
         return
+    check_storage("run-getter")
     getter = Getter()
-
-    async def inner():
-        loop = 0
-        while True:
-            logger.debug(f"getter loop {loop} start...")
-            await getter.run()
-            loop += 1
-            await asyncio.sleep(cycle)
-
-    asyncio.run(inner())
+    asyncio.run(with_metrics(getter_loop(getter, cycle), GETTER_METRICS_PORT))
 
 
 @cli.command()
@@ -100,6 +158,7 @@ def run_server():
     if not ENABLE_SERVER:
         logger.info("server not enabled, exit")
         return
+    check_storage("run-server")
     if IS_PROD:
         uvicorn.run(
             "proxypool.processors.server:app",
@@ -114,3 +173,57 @@ def run_server():
             port=API_PORT,
             reload=APP_DEBUG,
         )
+
+
+@cli.command()
+@click.option(
+    "--tester-cycle",
+    default=CYCLE_TESTER,
+    required=True,
+    type=click.IntRange(10, 30),
+    help="Tester 运行周期，即间隔多久运行一次测试",
+    show_default=True,
+)
+@click.option(
+    "--getter-cycle",
+    default=CYCLE_GETTER,
+    required=True,
+    type=click.IntRange(30, 180),
+    help="Getter 运行周期，即间隔多久运行一次代理获取",
+    show_default=True,
+)
+def run_all(tester_cycle, getter_cycle):
+    """
+    run getter, tester and server in one process
+    在同一进程中运行全部组件
+    """
+
+    # the api is only imported by commands serving it
+    from proxypool.processors.server import app, get_conn
+
+    async def inner():
+        # everything shares the storage of server and one event loop
+        storage = get_conn()
+        tester = Tester(storage) if ENABLE_TESTER else None
+        # staged proxies are tested at once instead of in the next cycle
+        fresh = asyncio.Event() if tester and ENABLE_GETTER and ENABLE_STAGING else None
+        tasks = []
+        if tester:
+            tasks.append(tester_loop(tester, tester_cycle))
+        if fresh is not None:
+            tasks.append(tester.run_fresh(fresh))
+        if ENABLE_GETTER:
+            tasks.append(getter_loop(Getter(storage, fresh), getter_cycle))
+        background = [asyncio.create_task(task) for task in tasks]
+        try:
+            if ENABLE_SERVER:
+                config = uvicorn.Config(app, host=API_HOST, port=API_PORT)
+                await uvicorn.Server(config).serve()
+            else:
+                await asyncio.gather(*background)
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+
+    asyncio.run(inner())
@@ -1 +1,4 @@
+from .ingest import IngestResult
+from .lease import Lease
 from .proxy import Proxy
+from .report import Report, ReportResult
@@ -0,0 +1,12 @@
+from attr import attr, attrs
+
+
+@attrs(slots=True)
+class IngestResult(object):
+    """
+    counts of a batch add
+    """
+
+    added = attr(type=int, default=0)
+    updated = attr(type=int, default=0)
+    rejected = attr(type=int, default=0)
@@ -0,0 +1,14 @@
+from attr import attr, attrs
+
+from proxypool.schemas.proxy import Proxy
+
+
+@attrs(slots=True)
+class Lease(object):
+    """
+    lease of a proxy checked out by a client
+    """
+
+    id = attr(type=str, default=None)
+    proxy = attr(type=Proxy, default=None)
+    expire = attr(type=int, default=None)
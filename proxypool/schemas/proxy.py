@@ -1,7 +1,7 @@
 from attr import attr, attrs
 
 
-@attrs
+@attrs(slots=True)
 class Proxy(object):
     """
     proxy schema
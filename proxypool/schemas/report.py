@@ -0,0 +1,27 @@
+from typing import Optional
+
+from attr import attr, attrs
+
+from proxypool.schemas.proxy import Proxy
+
+
+@attrs(slots=True)
+class Report(object):
+    """
+    outcome of a proxy reported by a client
+    """
+
+    proxy = attr(type=Proxy, default=None)
+    success = attr(type=bool, default=None)
+    latency = attr(type=Optional[float], default=None)
+
+
+@attrs(slots=True)
+class ReportResult(object):
+    """
+    counts of applied reports
+    """
+
+    applied = attr(type=int, default=0)
+    removed = attr(type=int, default=0)
+    rejected = attr(type=int, default=0)
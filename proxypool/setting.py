@@ -1,9 +1,13 @@
 import shutil
+from asyncio import TimeoutError
 from os.path import abspath, dirname, join
 
+from aiohttp import ClientError
 from aiohttp_retry.retry_options import RandomRetry
 from environs import Env
 from loguru import logger
+from marshmallow import ValidationError
+from marshmallow.validate import Range
 
 _ = RandomRetry
 
@@ -25,6 +29,9 @@ APP_TEST = IS_TEST = APP_ENV == TEST_MODE
 # ASGI args
 WORKERS = env.int("workers", 4)
 
+# storage of proxies, redis, or memory for a single process running everything
+STORAGE = env.str("STORAGE", "redis").lower()
+
 # redis host
 REDIS_HOST = env.str("PROXYPOOL_REDIS_HOST", env.str("REDIS_HOST", "127.0.0.1"))
 # redis port
@@ -42,31 +49,137 @@ REDIS_CONNECTION_STRING = env.str(
 # redis hash table key name
 REDIS_KEY = env.str("PROXYPOOL_REDIS_KEY", env.str("REDIS_KEY", "proxies:universal"))
 
+# max number of members sent to redis in one command of batch operations
+REDIS_BATCH_SIZE = env.int("REDIS_BATCH_SIZE", 1000)
+
 # proxy settings
 DEDUCTION_EXPIRATION_TIME = 20  # 到期时间的偏移量
 
 # definition of proxy number
-PROXY_NUMBER_MAX = 50000
-PROXY_NUMBER_MIN = 0
+# getter stops crawling above max, and is woken at once when live proxies drop below min
+PROXY_NUMBER_MAX = env.int("PROXY_NUMBER_MAX", 50000)
+PROXY_NUMBER_MIN = env.int("PROXY_NUMBER_MIN", 100)
 
 # definition of tester cycle, it will test every CYCLE_TESTER second
 CYCLE_TESTER = env.int("CYCLE_TESTER", 20)
 # definition of getter cycle, it will get proxy every CYCLE_GETTER second
 CYCLE_GETTER = env.int("CYCLE_GETTER", 100)
 GET_TIMEOUT = env.int("GET_TIMEOUT", 10)
+GET_DNS_CACHE_TTL = env.int("GET_DNS_CACHE_TTL", 300)
+# max number of urls fetched at the same time, by all crawlers and by one crawler
+GETTER_MAX_CONCURRENCY = env.int("GETTER_MAX_CONCURRENCY", 10)
+CRAWLER_MAX_CONCURRENCY = env.int("CRAWLER_MAX_CONCURRENCY", 3)
+# number of proxies saved at once when a crawler parses its response as a stream
+CRAWLER_BATCH_SIZE = env.int("CRAWLER_BATCH_SIZE", 500)
+# seconds one crawler may spend in a getter cycle
+CRAWLER_TIMEOUT = env.int("CRAWLER_TIMEOUT", 60)
+# getter cycle is doubled each time up to this factor while the pool is above PROXY_NUMBER_MIN
+GETTER_BACKOFF_MAX = env.int("GETTER_BACKOFF_MAX", 8)
+# min seconds between two getter runs when woken by a drained pool
+GETTER_COOLDOWN = env.int("GETTER_COOLDOWN", 10)
+# fetch urls again with their etag, last-modified or body hash and save only
+# proxies new since last fetch, until proxies of it would expire before next cycle
+ENABLE_INCREMENTAL_CRAWL = env.bool("ENABLE_INCREMENTAL_CRAWL", True)
 
 # definition of tester
 TEST_URL = env.str("TEST_URL", "http://www.baidu.com")
 TEST_TIMEOUT = env.int("TEST_TIMEOUT", 10)
 # only save anonymous proxy
 TEST_ANONYMOUS = env.bool("TEST_ANONYMOUS", True)
+# endpoint echoing the ip of client as json {"origin": ip}
+TEST_ANONYMOUS_URL = env.str("TEST_ANONYMOUS_URL", "https://httpbin.org/ip")
+# seconds the origin ip of ours is cached
+TEST_ORIGIN_IP_TTL = env.int("TEST_ORIGIN_IP_TTL", 300)
 TEST_VALID_STATUS = env.list("TEST_VALID_STATUS", [200, 206, 302])
+# named pools of proxies working for a target, as json like
+# {"google": {"url": "https://www.google.com", "status": [200], "cycle": 60}},
+# each stored like REDIS_KEY with its name as last part, e.g. proxies:google,
+# valid proxies are tested against url of each pool every cycle seconds,
+# url is required, names must not contain ":" or be the last part of
+# REDIS_KEY, and if it has no prefix, not be the suffix of a key derived from
+# it either, e.g. staging
+_REDIS_KEY_PREFIX, _, _REDIS_KEY_NAME = REDIS_KEY.rpartition(":")
+_RESERVED_POOL_NAMES = {_REDIS_KEY_NAME}
+if not _REDIS_KEY_PREFIX:
+    _RESERVED_POOL_NAMES |= set(
+        "schedule latency streak failures staging leases load events".split()
+    )
+
+
+def _validate_pools(pools: dict) -> None:
+    if not isinstance(pools, dict):
+        raise ValidationError("POOLS must be an object of pools by name")
+    for name, pool in pools.items():
+        if not name or ":" in name or name in _RESERVED_POOL_NAMES:
+            raise ValidationError(f"invalid pool name {name!r}")
+        if not isinstance(pool, dict) or not isinstance(pool.get("url"), str):
+            raise ValidationError(f"pool {name!r} must have a url to test against")
+
+
+POOLS = {
+    name: {
+        "url": pool["url"],
+        "status": pool.get("status", TEST_VALID_STATUS),
+        "cycle": pool.get("cycle", CYCLE_TESTER),
+    }
+    for name, pool in env.json("POOLS", "{}", validate=_validate_pools).items()
+}
 MAX_WORKERS = env.int("MAX_WORKERS", 20)
+# only test proxies whose next test is due, instead of all proxies every cycle
+ENABLE_TEST_SCHEDULE = env.bool("ENABLE_TEST_SCHEDULE", False)
+# interval between two tests of a proxy doubles with its success streak,
+# min must be positive or a claimed proxy is due again at once
+TEST_INTERVAL_MIN = env.int("TEST_INTERVAL_MIN", CYCLE_TESTER, validate=Range(min=1))
+TEST_INTERVAL_MAX = env.int("TEST_INTERVAL_MAX", 600)
+# a proxy is tested again before this ratio of its remaining ttl is passed
+TEST_INTERVAL_TTL_RATIO = env.float("TEST_INTERVAL_TTL_RATIO", 0.5)
+# weight of the newest measurement in the average latency of a proxy
+TEST_LATENCY_ALPHA = env.float("TEST_LATENCY_ALPHA", 0.3)
+# results of tests are written to redis in batch when either is reached
+TEST_FLUSH_SIZE = env.int("TEST_FLUSH_SIZE", 500)
+TEST_FLUSH_INTERVAL = env.int("TEST_FLUSH_INTERVAL", 5)
+# new proxies are staged and only served after they pass a test
+ENABLE_STAGING = env.bool("ENABLE_STAGING", True)
+# number of workers testing staged proxies at once in run-all
+TEST_FRESH_WORKERS = env.int("TEST_FRESH_WORKERS", 10)
+# connection pool of tester, shared by all tests of one cycle
+TEST_CONNECTOR_LIMIT = env.int("TEST_CONNECTOR_LIMIT", 100)
+TEST_DNS_CACHE_TTL = env.int("TEST_DNS_CACHE_TTL", 300)
+TEST_KEEPALIVE_TIMEOUT = env.int("TEST_KEEPALIVE_TIMEOUT", 15)
 
 # definition of api
 API_HOST = env.str("API_HOST", "0.0.0.0")
 API_PORT = env.int("API_PORT", 5555)
 API_THREADED = env.bool("API_THREADED", True)
+# max number of proxies of a page of /all
+API_PAGE_MAX_LIMIT = env.int("API_PAGE_MAX_LIMIT", 1000)
+# max number of proxies of /random?count=
+API_RANDOM_MAX_COUNT = env.int("API_RANDOM_MAX_COUNT", 500)
+# default and max seconds a proxy is leased to a client by /lease
+LEASE_TTL = env.int("LEASE_TTL", 60)
+LEASE_MAX_TTL = env.int("LEASE_MAX_TTL", 600)
+# max number of clients leasing the same proxy at once
+LEASE_MAX_CONCURRENCY = env.int("LEASE_MAX_CONCURRENCY", 1)
+# number of random proxies tried by one checkout
+LEASE_CANDIDATES = env.int("LEASE_CANDIDATES", 16)
+# failures in a row reported by clients before a proxy is removed
+REPORT_FAILURE_THRESHOLD = env.int("REPORT_FAILURE_THRESHOLD", 3)
+# max number of reports in one POST /report
+REPORT_MAX_SIZE = env.int("REPORT_MAX_SIZE", 1000)
+# number of fastest proxies /random?strategy=fastest|weighted picks from
+RANDOM_CANDIDATES = env.int("RANDOM_CANDIDATES", 20)
+# serve /random and /count from an in-process snapshot of live proxies
+ENABLE_SERVER_CACHE = env.bool("ENABLE_SERVER_CACHE", False)
+# seconds between two refreshes of the snapshot
+SERVER_CACHE_INTERVAL = env.int("SERVER_CACHE_INTERVAL", 5)
+# snapshot older than it falls back to redis
+SERVER_CACHE_MAX_STALENESS = env.int("SERVER_CACHE_MAX_STALENESS", 15)
+
+# /metrics of run-tester and run-getter processes, 0 to disable, server and
+# run-all serve it on api port, local only by default
+METRICS_HOST = env.str("METRICS_HOST", "127.0.0.1")
+TESTER_METRICS_PORT = env.int("TESTER_METRICS_PORT", 5556)
+GETTER_METRICS_PORT = env.int("GETTER_METRICS_PORT", 5557)
 
 # flags of enable
 ENABLE_TESTER = env.bool("ENABLE_TESTER", True)
@@ -79,7 +192,7 @@ ENABLE_LOG_ERROR_FILE = env.bool("ENABLE_LOG_ERROR_FILE", True)
 
 LOG_LEVEL_MAP = {DEV_MODE: "DEBUG", TEST_MODE: "INFO", PROD_MODE: "ERROR"}
 
-LOG_LEVEL = LOG_LEVEL_MAP.get(APP_ENV)
+LOG_LEVEL = LOG_LEVEL_MAP.get(APP_ENV, "INFO")
 LOG_ROTATION = env.str("LOG_ROTATION", "500MB")
 LOG_RETENTION = env.str("LOG_RETENTION", "1 week")
 
@@ -103,4 +216,7 @@ else:
 # aiohttp-retry
 RAISE_FOR_STATUS = env.bool("RAISE_FOR_STATUS", False)
 RETRIES = 3
-RETRY_OPTION = eval(env.str("RETRY_OPTION", "RandomRetry"))(attempts=RETRIES)
+# retry on server errors and network errors, RETRIES is the total of attempts
+RETRY_OPTION = eval(env.str("RETRY_OPTION", "RandomRetry"))(
+    attempts=RETRIES, exceptions={ClientError, TimeoutError}
+)
@@ -0,0 +1,23 @@
+from typing import Any, Optional
+
+from proxypool.setting import STORAGE
+from proxypool.storages.base import BaseStorage
+from proxypool.storages.memory import MemoryClient
+from proxypool.storages.redis import RedisClient
+
+# memory storage is shared by everything in the process
+_memory: Optional[MemoryClient] = None
+
+
+def get_storage(**kwargs: Any) -> BaseStorage:
+    """
+    get storage selected by STORAGE
+    :param kwargs: args of redis client
+    :return: redis client, or memory storage of this process
+    """
+    global _memory
+    if STORAGE == "memory":
+        if _memory is None:
+            _memory = MemoryClient()
+        return _memory
+    return RedisClient(**kwargs)
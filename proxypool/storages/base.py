@@ -0,0 +1,310 @@
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from proxypool.exceptions import PoolEmptyException
+from proxypool.schemas import IngestResult, Lease, Proxy, Report, ReportResult
+from proxypool.setting import (
+    DEDUCTION_EXPIRATION_TIME,
+    LEASE_TTL,
+    PROXY_NUMBER_MIN,
+    RANDOM_CANDIDATES,
+    REDIS_BATCH_SIZE,
+)
+from proxypool.utils.proxy import filter_valid_proxies
+
+# event published when live proxies drop below PROXY_NUMBER_MIN
+LOW_EVENT = "low"
+
+
+def latest_expires(
+    proxy_list: List[Proxy], deduction: int
+) -> Tuple[Dict[str, int], int]:
+    """
+    validate proxies to ingest, duplicates keep the latest expire
+    :param proxy_list: List[Proxy]
+    :param deduction: Deduction of expiration time
+    :return: deducted expire of valid proxies, and number of rejected proxies
+    """
+    valid = filter_valid_proxies(proxy_list)
+    rejected = len(proxy_list) - len(valid)
+    if rejected:
+        logger.info(f"throw {rejected} invalid proxies")
+    expires: Dict[str, int] = {}
+    for member, expire in valid:
+        expire -= deduction
+        if member not in expires or expire > expires[member]:
+            expires[member] = expire
+    return expires, rejected
+
+
+def encode_cursor(proxy: Proxy) -> str:
+    """
+    cursor of page after proxy
+    :param proxy: last proxy of page
+    :return: cursor, <expire>,<host>:<port>
+    """
+    return f"{proxy.expire},{proxy.string()}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """
+    parse cursor of page, raise ValueError if malformed
+    :param cursor: cursor returned with last page
+    :return: expire and proxy of last proxy of page
+    """
+    expire, _, member = cursor.partition(",")
+    if not member:
+        raise ValueError(f"invalid cursor {cursor}")
+    return int(expire), member
+
+
+class BaseStorage:
+    """
+    storage of proxypool, proxies are kept until their expire
+    """
+
+    async def add(
+        self, proxy: Proxy, deduction: int = DEDUCTION_EXPIRATION_TIME
+    ) -> int:
+        """
+        add proxy and set it to init expire
+        :param proxy: proxy, ip:port
+        :param deduction: Deduction of expiration time
+        :return:
+            0 exist
+            1 not exist
+        """
+        return (await self.batch_add([proxy], deduction)).added
+
+    async def batch_add(
+        self, proxy_list: List[Proxy], deduction: int = DEDUCTION_EXPIRATION_TIME
+    ) -> IngestResult:
+        """
+        batch add proxy and set it to init expire,
+        invalid proxies are rejected, duplicates keep the latest expire,
+        expire of existing proxies is only extended
+        :param proxy_list: List[Proxy], ip:port
+        :param deduction: Deduction of expiration time
+        :return: numbers of added, updated and rejected proxies
+        """
+        raise NotImplementedError
+
+    async def stage(
+        self, proxy_list: List[Proxy], deduction: int = DEDUCTION_EXPIRATION_TIME
+    ) -> IngestResult:
+        """
+        batch stage new proxies to be tested before they are served,
+        validated like batch_add, expire of served proxies is extended at once
+        :param proxy_list: List[Proxy], ip:port
+        :param deduction: Deduction of expiration time
+        :return: numbers of newly staged, updated and rejected proxies
+        """
+        raise NotImplementedError
+
+    def staged(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        pop staged proxies in chunks, a popped proxy is tested once, passed
+        ones are added with batch_add
+        :param count: max chunk size
+        :return: chunks of proxies
+        """
+        raise NotImplementedError
+
+    async def random(self, strategy: str = "random") -> Proxy:
+        """
+        get random proxy
+        if not exists, raise error
+        :param strategy: random, fastest or weighted, see sample
+        :return: proxy, like 8.8.8.8:8
+        """
+        if proxies := await self.sample(strategy=strategy):
+            return proxies[0]
+        raise PoolEmptyException
+
+    async def sample(
+        self, count: int = 1, min_ttl: int = 0, strategy: str = "random"
+    ) -> List[Proxy]:
+        """
+        get distinct random proxies
+        :param count: max number of proxies
+        :param min_ttl: min seconds proxies must stay alive
+        :param strategy: random, fastest or weighted
+        :return: list of proxies, less than count if the pool is short
+        """
+        raise NotImplementedError
+
+    async def fastest(
+        self, number: int = RANDOM_CANDIDATES, min_ttl: int = 0
+    ) -> List[Tuple[Proxy, float]]:
+        """
+        get live proxies with the lowest latency
+        :param number: max number of proxies
+        :param min_ttl: min seconds proxies must stay alive
+        :return: list of (proxy, latency in ms), fastest first
+        """
+        raise NotImplementedError
+
+    async def delete(self, proxy: Proxy) -> int:
+        """
+        delete proxy
+        :param proxy: proxy
+        :return: number of removed proxies
+        """
+        return await self.batch_delete([proxy])
+
+    async def batch_delete(self, proxy_list: List[Proxy]) -> int:
+        """
+        batch delete proxies with their schedule and stats
+        :param proxy_list: List[Proxy]
+        :return: number of removed proxies
+        """
+        raise NotImplementedError
+
+    async def expired_delete(self) -> int:
+        """
+        remove expired proxy
+        :return: number of removed proxies
+        """
+        raise NotImplementedError
+
+    async def exists(self, proxy: Proxy) -> bool:
+        """
+        if proxy exists
+        :param proxy: proxy
+        :return: if exists, bool
+        """
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        """
+        get count of live proxies
+        :return: count, int
+        """
+        raise NotImplementedError
+
+    async def all(self) -> List[Proxy]:
+        """
+        get all live proxies
+        :return: list of proxies
+        """
+        raise NotImplementedError
+
+    async def page(
+        self, cursor: Optional[str], limit: int
+    ) -> Tuple[List[Proxy], Optional[str]]:
+        """
+        get a page of live proxies ordered by expire and proxy, no proxy is
+        skipped when others are removed meanwhile, a proxy whose expire is
+        extended meanwhile may be returned again
+        :param cursor: cursor returned with last page, None for the first page
+        :param limit: max number of proxies
+        :return: proxies and cursor of next page, None if it is the last page
+        """
+        raise NotImplementedError
+
+    def scan(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        iterate live proxies in chunks, a proxy may be returned more than once
+        :param count: hint of chunk size
+        :return: chunks of proxies
+        """
+        raise NotImplementedError
+
+    async def schedule_all(self) -> None:
+        """
+        schedule proxies added before schedule was enabled, they are due at once
+        :return:
+        """
+        raise NotImplementedError
+
+    def due(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        claim proxies due to be tested in chunks
+        :param count: max chunk size
+        :return: chunks of proxies
+        """
+        raise NotImplementedError
+
+    async def record(self, results: List[Tuple[Proxy, float]]) -> int:
+        """
+        record latency and success of passed proxies
+        :param results: list of (proxy, latency in ms)
+        :return: number of recorded proxies
+        """
+        raise NotImplementedError
+
+    async def reschedule(self, proxy_list: List[Proxy]) -> int:
+        """
+        schedule next test of passed proxies by their success streak and ttl
+        :param proxy_list: List[Proxy]
+        :return: number of rescheduled proxies
+        """
+        raise NotImplementedError
+
+    async def checkout(self, ttl: int = LEASE_TTL) -> Optional[Lease]:
+        """
+        lease a random live proxy, a lease not released is reaped after ttl
+        :param ttl: seconds of lease
+        :return: lease, None if no proxy is available
+        """
+        raise NotImplementedError
+
+    async def release(self, lease_id: str, success: Optional[bool] = None) -> bool:
+        """
+        end lease, outcome of the proxy is reported if given
+        :param lease_id: id of lease
+        :param success: if proxy worked for the client, None if not reported
+        :return: if lease existed
+        """
+        raise NotImplementedError
+
+    async def report(self, reports: List[Report]) -> ReportResult:
+        """
+        apply outcomes reported by clients, proxies failed
+        REPORT_FAILURE_THRESHOLD times in a row are removed
+        :param reports: List[Report]
+        :return: numbers of applied reports, removed and rejected proxies
+        """
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        """
+        remove all proxies with their schedule, stats, staging and leases
+        :return:
+        """
+        raise NotImplementedError
+
+    def pool(self, name: str) -> "BaseStorage":
+        """
+        storage of a named pool, a separate set of proxies which shares the
+        connection of this storage
+        :param name: name of pool
+        :return: storage
+        """
+        raise NotImplementedError
+
+    async def publish(self, event: str) -> None:
+        """
+        publish event to listeners of events
+        :param event: event, like LOW_EVENT
+        :return:
+        """
+        raise NotImplementedError
+
+    def events(self) -> AsyncIterator[str]:
+        """
+        listen to published events until closed
+        :return: events
+        """
+        raise NotImplementedError
+
+    async def notify_low(self) -> int:
+        """
+        publish LOW_EVENT if live proxies are below PROXY_NUMBER_MIN
+        :return: count of live proxies
+        """
+        count = await self.count()
+        if count < PROXY_NUMBER_MIN:
+            await self.publish(LOW_EVENT)
+        return count
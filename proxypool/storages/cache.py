@@ -0,0 +1,122 @@
+import asyncio
+import time
+from bisect import bisect_left
+from random import randrange
+from typing import List, Optional
+
+from loguru import logger
+
+from proxypool.schemas.proxy import Proxy
+from proxypool.setting import SERVER_CACHE_INTERVAL, SERVER_CACHE_MAX_STALENESS
+from proxypool.storages.base import BaseStorage
+
+
+class ProxyCache:
+    """
+    in-process snapshot of live proxies, refreshed in background
+    """
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        interval: int = SERVER_CACHE_INTERVAL,
+        max_staleness: int = SERVER_CACHE_MAX_STALENESS,
+    ):
+        """
+        init cache
+        :param storage: storage to load proxies from
+        :param interval: seconds between two refreshes
+        :param max_staleness: snapshot older than it is not served
+        """
+        self.storage = storage
+        self.interval = interval
+        self.max_staleness = max_staleness
+        # proxies sorted by expire, expires is kept aside for bisect
+        self.proxies: List[Proxy] = []
+        self.expires: List[int] = []
+        self.refreshed_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_seconds = 0.0
+
+    @property
+    def fresh(self) -> bool:
+        """
+        if snapshot is young enough to be served
+        """
+        return (
+            self.refreshed_at is not None
+            and time.monotonic() - self.refreshed_at <= self.max_staleness
+        )
+
+    async def refresh(self) -> None:
+        """
+        reload snapshot from storage, proxies come back sorted by expire
+        """
+        start = time.perf_counter()
+        proxies = await self.storage.all()
+        self.proxies = proxies
+        self.expires = [proxy.expire for proxy in proxies]
+        self.refreshed_at = time.monotonic()
+        self.refreshes += 1
+        self.refresh_seconds = time.perf_counter() - start
+        logger.debug(
+            f"cache refreshed {len(proxies)} proxies in {self.refresh_seconds:.3f}s"
+        )
+
+    def _live_index(self) -> int:
+        """
+        index of the first proxy which is not expired
+        """
+        return bisect_left(self.expires, int(time.time()))
+
+    def random(self) -> Optional[Proxy]:
+        """
+        get random live proxy from snapshot
+        :return: proxy, None if snapshot can not answer
+        """
+        if self.fresh:
+            index = self._live_index()
+            if index < len(self.proxies):
+                self.hits += 1
+                return self.proxies[randrange(index, len(self.proxies))]
+        self.misses += 1
+        return None
+
+    def count(self) -> Optional[int]:
+        """
+        get count of live proxies in snapshot
+        :return: count, None if snapshot is stale
+        """
+        if self.fresh:
+            self.hits += 1
+            return len(self.proxies) - self._live_index()
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        """
+        metrics of cache
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self.proxies),
+            "fresh": self.fresh,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_seconds": self.refresh_seconds,
+        }
+
+    async def run(self) -> None:
+        """
+        refresh snapshot forever
+        """
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"cache refresh failed: {e!r}")
+            await asyncio.sleep(self.interval)
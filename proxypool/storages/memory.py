@@ -0,0 +1,573 @@
+import asyncio
+import heapq
+import time
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from math import log
+from operator import itemgetter
+from random import random, randrange, sample
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from proxypool.schemas import IngestResult, Lease, Proxy, Report, ReportResult
+from proxypool.setting import (
+    DEDUCTION_EXPIRATION_TIME,
+    LEASE_CANDIDATES,
+    LEASE_MAX_CONCURRENCY,
+    LEASE_TTL,
+    RANDOM_CANDIDATES,
+    REDIS_BATCH_SIZE,
+    REPORT_FAILURE_THRESHOLD,
+    TEST_INTERVAL_MAX,
+    TEST_INTERVAL_MIN,
+    TEST_INTERVAL_TTL_RATIO,
+    TEST_LATENCY_ALPHA,
+)
+from proxypool.storages.base import (
+    BaseStorage,
+    decode_cursor,
+    encode_cursor,
+    latest_expires,
+)
+from proxypool.utils.metrics import DELETED
+from proxypool.utils.proxy import is_valid_proxy
+
+# number of random picks from the whole pool before falling back to live ones
+RANDOM_ATTEMPTS = 8
+
+
+def to_proxy(member: str, expire: int) -> Proxy:
+    """
+    build proxy from a stored member, which is always valid
+    :param member: host:port
+    :param expire: expire of proxy
+    :return: proxy
+    """
+    host, port = member.rsplit(":", 1)
+    return Proxy(host=host, port=int(port), expire=expire)
+
+
+class MemoryClient(BaseStorage):
+    """
+    in-process storage of proxypool, for a single process running everything
+    or benchmarks, nothing is persisted, every method is atomic as none of
+    them awaits
+    """
+
+    def __init__(self):
+        """
+        init memory storage
+        """
+        self._reset()
+        # queues of listeners of events and storages of named pools, kept by clear
+        self.listeners: List[asyncio.Queue] = []
+        self.pools: Dict[str, MemoryClient] = {}
+
+    def _reset(self) -> None:
+        """
+        start from an empty storage
+        """
+        # expire of proxies, sorted (expire, proxy) index for live ranges,
+        # and array of proxies with their positions for O(1) random pick
+        self.expires: Dict[str, int] = {}
+        self.index: List[Tuple[int, str]] = []
+        self.members: List[str] = []
+        self.positions: Dict[str, int] = {}
+        # next test time of proxies, as a heap with stale entries skipped,
+        # their average latency, success streak and reported failures
+        self.schedule: Dict[str, int] = {}
+        self.schedule_heap: List[Tuple[int, str]] = []
+        self.latency: Dict[str, float] = {}
+        self.streak: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        # expire of new proxies waiting to be tested before they are served
+        self.staging: Dict[str, int] = {}
+        # proxy and expire of leases, and number of leases of proxies
+        self.leases: Dict[str, Tuple[str, int]] = {}
+        self.load: Dict[str, int] = {}
+
+    def _live(self, min_score: int) -> int:
+        """
+        index of the first proxy in index which expires at or after min_score
+        """
+        return bisect_left(self.index, min_score, key=itemgetter(0))
+
+    def _set_expire(self, member: str, expire: int) -> None:
+        """
+        add proxy or move it in index
+        """
+        current = self.expires.get(member)
+        if current is None:
+            self.positions[member] = len(self.members)
+            self.members.append(member)
+        else:
+            del self.index[bisect_left(self.index, (current, member))]
+        self.expires[member] = expire
+        insort(self.index, (expire, member))
+
+    def _set_schedule(self, member: str, due: int) -> None:
+        """
+        set next test time of proxy
+        """
+        self.schedule[member] = due
+        heapq.heappush(self.schedule_heap, (due, member))
+        # drop stale entries once they outnumber the scheduled ones
+        if len(self.schedule_heap) > 2 * len(self.schedule) + REDIS_BATCH_SIZE:
+            self.schedule_heap = [
+                (due, member) for member, due in self.schedule.items()
+            ]
+            heapq.heapify(self.schedule_heap)
+
+    def _remove(self, member: str) -> bool:
+        """
+        remove proxy with its schedule and stats
+        """
+        expire = self.expires.pop(member, None)
+        if expire is None:
+            return False
+        del self.index[bisect_left(self.index, (expire, member))]
+        # move the last proxy into the hole of array
+        position = self.positions.pop(member)
+        last = self.members.pop()
+        if last != member:
+            self.members[position] = last
+            self.positions[last] = position
+        self.schedule.pop(member, None)
+        self.latency.pop(member, None)
+        self.streak.pop(member, None)
+        self.failures.pop(member, None)
+        return True
+
+    async def batch_add(
+        self, proxy_list: List[Proxy], deduction: int = DEDUCTION_EXPIRATION_TIME
+    ) -> IngestResult:
+        """
+        batch add proxy and set it to init expire,
+        invalid proxies are rejected, duplicates keep the latest expire,
+        expire of existing proxies is only extended, new ones are due at once
+        :param proxy_list: List[Proxy], ip:port
+        :param deduction: Deduction of expiration time
+        :return: numbers of added, updated and rejected proxies
+        """
+        expires, rejected = latest_expires(proxy_list, deduction)
+        result = IngestResult(rejected=rejected)
+        for member, expire in expires.items():
+            current = self.expires.get(member)
+            if current is None:
+                self._set_expire(member, expire)
+                if member not in self.schedule:
+                    self._set_schedule(member, 0)
+                result.added += 1
+            elif expire > current:
+                self._set_expire(member, expire)
+                result.updated += 1
+        return result
+
+    async def stage(
+        self, proxy_list: List[Proxy], deduction: int = DEDUCTION_EXPIRATION_TIME
+    ) -> IngestResult:
+        """
+        batch stage new proxies to be tested before they are served,
+        validated like batch_add, expire of served proxies is extended at once
+        :param proxy_list: List[Proxy], ip:port
+        :param deduction: Deduction of expiration time
+        :return: numbers of newly staged, updated and rejected proxies
+        """
+        expires, rejected = latest_expires(proxy_list, deduction)
+        result = IngestResult(rejected=rejected)
+        for member, expire in expires.items():
+            current = self.expires.get(member)
+            if current is not None:
+                if expire > current:
+                    self._set_expire(member, expire)
+                    result.updated += 1
+                continue
+            staged = self.staging.get(member)
+            if staged is None:
+                result.added += 1
+            if staged is None or expire > staged:
+                self.staging[member] = expire
+        return result
+
+    async def staged(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        pop staged proxies in chunks, latest expire first, a popped proxy is
+        not staged any more so it is tested once, expired ones are dropped
+        :param count: max chunk size
+        :return: chunks of proxies
+        """
+        while True:
+            items = heapq.nlargest(count, self.staging.items(), key=itemgetter(1))
+            for member, _ in items:
+                del self.staging[member]
+            now = int(time.time())
+            if proxies := [
+                to_proxy(member, expire) for member, expire in items if expire >= now
+            ]:
+                yield proxies
+            if len(items) < count:
+                return
+
+    async def sample(
+        self, count: int = 1, min_ttl: int = 0, strategy: str = "random"
+    ) -> List[Proxy]:
+        """
+        get distinct random proxies
+        random: a single proxy is picked from the array, retried a few times
+            if expired, others are picked by rank among live proxies
+        fastest: pick among max(RANDOM_CANDIDATES, count) live proxies with the
+            lowest latency
+        weighted: same candidates as fastest, weighted by 1 / latency
+        fall back to random if no latency is recorded
+        :param count: max number of proxies
+        :param min_ttl: min seconds proxies must stay alive
+        :param strategy: random, fastest or weighted
+        :return: list of proxies, less than count if the pool is short
+        """
+        if strategy != "random" and (
+            candidates := await self.fastest(max(RANDOM_CANDIDATES, count), min_ttl)
+        ):
+            if strategy == "weighted":
+                # weighted sampling without replacement, keep the largest keys
+                # u ** (1 / weight) compared as log(u) * latency, which keeps
+                # the order while u ** latency underflows to 0 for slow proxies
+                candidates.sort(key=lambda item: log(1 - random()) * max(item[1], 1))
+                return [proxy for proxy, _ in candidates[-count:]]
+            return [
+                proxy for proxy, _ in sample(candidates, min(count, len(candidates)))
+            ]
+        min_score = int(time.time()) + min_ttl
+        if count == 1 and self.members:
+            for _ in range(RANDOM_ATTEMPTS):
+                member = self.members[randrange(len(self.members))]
+                if (expire := self.expires[member]) >= min_score:
+                    return [to_proxy(member, expire)]
+        start = self._live(min_score)
+        ranks = sample(
+            range(start, len(self.index)), min(count, len(self.index) - start)
+        )
+        return [to_proxy(self.index[rank][1], self.index[rank][0]) for rank in ranks]
+
+    async def fastest(
+        self, number: int = RANDOM_CANDIDATES, min_ttl: int = 0
+    ) -> List[Tuple[Proxy, float]]:
+        """
+        get live proxies with the lowest latency
+        :param number: max number of proxies
+        :param min_ttl: min seconds proxies must stay alive
+        :return: list of (proxy, latency in ms), fastest first
+        """
+        min_score = int(time.time()) + min_ttl
+        return [
+            (to_proxy(member, self.expires[member]), latency)
+            for member, latency in heapq.nsmallest(
+                number,
+                (
+                    item
+                    for item in self.latency.items()
+                    if self.expires[item[0]] >= min_score
+                ),
+                key=itemgetter(1),
+            )
+        ]
+
+    async def batch_delete(self, proxy_list: List[Proxy]) -> int:
+        """
+        batch delete proxies with their schedule and stats
+        :param proxy_list: List[Proxy]
+        :return: number of removed proxies
+        """
+        if not proxy_list:
+            return 0
+        logger.info(f"remove {len(proxy_list)} proxies")
+        return sum(self._remove(proxy.string()) for proxy in proxy_list)
+
+    async def expired_delete(self) -> int:
+        """
+        remove expired proxy
+        :return: number of removed proxies
+        """
+        logger.info(f"remove expired proxy")
+        now = int(time.time())
+        for member in [m for m, expire in self.staging.items() if expire <= now]:
+            del self.staging[member]
+        expired = [member for _, member in self.index[: self._live(now + 1)]]
+        for member in expired:
+            self._remove(member)
+        return len(expired)
+
+    async def exists(self, proxy: Proxy) -> bool:
+        """
+        if proxy exists
+        :param proxy: proxy
+        :return: if exists, bool
+        """
+        return proxy.string() in self.expires
+
+    async def count(self) -> int:
+        """
+        get count of live proxies
+        :return: count, int
+        """
+        return len(self.index) - self._live(int(time.time()))
+
+    async def all(self) -> List[Proxy]:
+        """
+        get all live proxies
+        :return: list of proxies
+        """
+        return [
+            to_proxy(member, expire)
+            for expire, member in self.index[self._live(int(time.time())) :]
+        ]
+
+    async def page(
+        self, cursor: Optional[str], limit: int
+    ) -> Tuple[List[Proxy], Optional[str]]:
+        """
+        get a page of live proxies ordered by expire and proxy
+        :param cursor: cursor returned with last page, None for the first page
+        :param limit: max number of proxies
+        :return: proxies and cursor of next page, None if it is the last page
+        """
+        start = self._live(int(time.time()))
+        if cursor:
+            start = max(start, bisect_right(self.index, decode_cursor(cursor)))
+        proxies = [
+            to_proxy(member, expire)
+            for expire, member in self.index[start : start + limit]
+        ]
+        if start + limit >= len(self.index):
+            return proxies, None
+        return proxies, encode_cursor(proxies[-1])
+
+    async def scan(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        iterate live proxies in chunks of a snapshot
+        :param count: chunk size
+        :return: chunks of proxies
+        """
+        index = self.index[self._live(int(time.time())) :]
+        for i in range(0, len(index), count):
+            yield [to_proxy(member, expire) for expire, member in index[i : i + count]]
+
+    async def schedule_all(self) -> None:
+        """
+        schedule proxies added before schedule was enabled, they are due at once
+        :return:
+        """
+        for member in self.expires:
+            if member not in self.schedule:
+                self._set_schedule(member, 0)
+
+    async def due(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        claim proxies due to be tested in chunks, a claimed proxy is not due
+        again for TEST_INTERVAL_MIN so it is tested once even if never rescheduled
+        :param count: max chunk size
+        :return: chunks of proxies
+        """
+        while True:
+            now = int(time.time())
+            proxies = []
+            claimed: List[str] = []
+            while (
+                len(claimed) < count
+                and self.schedule_heap
+                and self.schedule_heap[0][0] <= now
+            ):
+                due, member = heapq.heappop(self.schedule_heap)
+                # skip entries replaced by a later schedule
+                if self.schedule.get(member) != due:
+                    continue
+                claimed.append(member)
+                expire = self.expires.get(member)
+                if expire is not None and expire >= now:
+                    proxies.append(to_proxy(member, expire))
+                else:
+                    del self.schedule[member]
+            for proxy in proxies:
+                self._set_schedule(proxy.string(), now + TEST_INTERVAL_MIN)
+            if proxies:
+                yield proxies
+            if len(claimed) < count:
+                return
+
+    async def record(self, results: List[Tuple[Proxy, float]]) -> int:
+        """
+        record latency and success of passed proxies
+        :param results: list of (proxy, latency in ms)
+        :return: number of recorded proxies
+        """
+        recorded = 0
+        for proxy, latency in results:
+            member = proxy.string()
+            if member in self.expires:
+                self._record(member, latency)
+                self.streak[member] = self.streak.get(member, 0) + 1
+                recorded += 1
+        return recorded
+
+    def _record(self, member: str, latency: float) -> None:
+        """
+        average latency as old + (new - old) * alpha
+        """
+        old = self.latency.get(member)
+        if old is not None:
+            latency = old + (latency - old) * TEST_LATENCY_ALPHA
+        self.latency[member] = latency
+
+    async def reschedule(self, proxy_list: List[Proxy]) -> int:
+        """
+        schedule next test of passed proxies, interval doubles with the success
+        streak between min and max, and is capped by a ratio of the remaining ttl
+        :param proxy_list: List[Proxy]
+        :return: number of rescheduled proxies
+        """
+        now = int(time.time())
+        scheduled = 0
+        for proxy in proxy_list:
+            member = proxy.string()
+            if member not in self.schedule:
+                continue
+            streak = self.streak.get(member, 1)
+            interval = min(TEST_INTERVAL_MIN * 2 ** (streak - 1), TEST_INTERVAL_MAX)
+            remain = (proxy.expire - now) * TEST_INTERVAL_TTL_RATIO
+            interval = min(interval, max(remain, TEST_INTERVAL_MIN))
+            self._set_schedule(member, int(now + interval))
+            scheduled += 1
+        return scheduled
+
+    def _end_lease(self, lease_id: str) -> Optional[str]:
+        """
+        remove lease and decrease load of its proxy
+        """
+        lease = self.leases.pop(lease_id, None)
+        if not lease:
+            return None
+        member = lease[0]
+        if (load := self.load.get(member, 0) - 1) <= 0:
+            self.load.pop(member, None)
+        else:
+            self.load[member] = load
+        return member
+
+    async def checkout(self, ttl: int = LEASE_TTL) -> Optional[Lease]:
+        """
+        lease a random live proxy leased by less than LEASE_MAX_CONCURRENCY
+        clients, a lease not released is reaped after ttl
+        :param ttl: seconds of lease
+        :return: lease, None if no proxy is available
+        """
+        now = int(time.time())
+        for lease_id in [
+            id for id, (_, expire) in self.leases.items() if expire <= now
+        ]:
+            self._end_lease(lease_id)
+        start = self._live(now)
+        live = len(self.index) - start
+        if live <= 0:
+            return None
+        for _ in range(LEASE_CANDIDATES):
+            expire, member = self.index[start + randrange(live)]
+            if self.load.get(member, 0) < LEASE_MAX_CONCURRENCY:
+                self.load[member] = self.load.get(member, 0) + 1
+                lease_id = uuid.uuid4().hex
+                self.leases[lease_id] = (member, now + ttl)
+                return Lease(
+                    id=lease_id, proxy=to_proxy(member, expire), expire=now + ttl
+                )
+        return None
+
+    async def release(self, lease_id: str, success: Optional[bool] = None) -> bool:
+        """
+        end lease, outcome of the proxy is reported if given
+        :param lease_id: id of lease
+        :param success: if proxy worked for the client, None if not reported
+        :return: if lease existed
+        """
+        member = self._end_lease(lease_id)
+        if not member:
+            return False
+        if success is not None:
+            await self.report([Report(proxy=to_proxy(member, 0), success=success)])
+        return True
+
+    async def report(self, reports: List[Report]) -> ReportResult:
+        """
+        apply outcomes reported by clients, a success clears failures and
+        defers next test, a failure makes the proxy due to be tested and
+        removes it after REPORT_FAILURE_THRESHOLD failures in a row, reports of
+        unknown proxies are ignored
+        :param reports: List[Report]
+        :return: numbers of applied reports, removed and rejected proxies
+        """
+        result = ReportResult()
+        now = int(time.time())
+        for report in reports:
+            if not report.proxy or not is_valid_proxy(member := report.proxy.string()):
+                result.rejected += 1
+                continue
+            if member not in self.expires:
+                continue
+            result.applied += 1
+            if report.success:
+                self.failures.pop(member, None)
+                if report.latency is not None:
+                    self._record(member, report.latency)
+                due = self.schedule.get(member)
+                if due is not None and due < now + TEST_INTERVAL_MIN:
+                    self._set_schedule(member, now + TEST_INTERVAL_MIN)
+                continue
+            self.failures[member] = self.failures.get(member, 0) + 1
+            if self.failures[member] >= REPORT_FAILURE_THRESHOLD:
+                self._remove(member)
+                result.removed += 1
+                continue
+            self.streak.pop(member, None)
+            if member in self.schedule:
+                self._set_schedule(member, now)
+        if result.removed:
+            logger.info(f"remove {result.removed} proxies reported failed")
+            DELETED.labels("reported").inc(result.removed)
+        return result
+
+    async def clear(self) -> None:
+        """
+        remove all proxies with their schedule, stats, staging and leases
+        :return:
+        """
+        self._reset()
+
+    def pool(self, name: str) -> "MemoryClient":
+        """
+        storage of a named pool, a separate set of proxies in this process
+        :param name: name of pool
+        :return: storage
+        """
+        if name not in self.pools:
+            self.pools[name] = MemoryClient()
+        return self.pools[name]
+
+    async def publish(self, event: str) -> None:
+        """
+        publish event to listeners of events, in this process only
+        :param event: event, like LOW_EVENT
+        :return:
+        """
+        for queue in self.listeners:
+            queue.put_nowait(event)
+
+    async def events(self) -> AsyncIterator[str]:
+        """
+        listen to published events until closed
+        :return: events
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self.listeners.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.listeners.remove(queue)
@@ -1,37 +1,72 @@
 import time
-from random import choice
-from typing import List
+import uuid
+from math import log
+from random import random, sample
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 from loguru import logger
 from redis.asyncio import ConnectionPool, Redis
+from redis.commands.core import AsyncScript
 
-from proxypool.exceptions import PoolEmptyException
-from proxypool.schemas.proxy import Proxy
+from proxypool.schemas import IngestResult, Lease, Proxy, Report, ReportResult
 from proxypool.setting import (
     DEDUCTION_EXPIRATION_TIME,
+    LEASE_CANDIDATES,
+    LEASE_MAX_CONCURRENCY,
+    LEASE_TTL,
+    RANDOM_CANDIDATES,
+    REDIS_BATCH_SIZE,
     REDIS_CONNECTION_STRING,
     REDIS_DB,
     REDIS_HOST,
     REDIS_KEY,
     REDIS_PASSWORD,
     REDIS_PORT,
+    REPORT_FAILURE_THRESHOLD,
+    TEST_INTERVAL_MAX,
+    TEST_INTERVAL_MIN,
+    TEST_INTERVAL_TTL_RATIO,
+    TEST_LATENCY_ALPHA,
 )
+from proxypool.storages.base import (
+    BaseStorage,
+    decode_cursor,
+    encode_cursor,
+    latest_expires,
+)
+from proxypool.storages.scripts import (
+    CHECKOUT_SCRIPT,
+    CLAIM_SCRIPT,
+    EXPIRE_SCRIPT,
+    FASTEST_SCRIPT,
+    INGEST_SCRIPT,
+    PAGE_SCRIPT,
+    RECORD_SCRIPT,
+    RELEASE_SCRIPT,
+    REPORT_SCRIPT,
+    RESCHEDULE_SCRIPT,
+    SAMPLE_SCRIPT,
+    STAGE_SCRIPT,
+)
+from proxypool.utils.metrics import DELETED, REDIS_SECONDS
 from proxypool.utils.proxy import convert_proxies, convert_proxy, is_valid_proxy
 
 
-class RedisClient:
+class RedisClient(BaseStorage):
     """
     redis connection client of proxypool
     """
 
     def __init__(
         self,
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        password=REDIS_PASSWORD,
-        db=REDIS_DB,
-        connection_string=REDIS_CONNECTION_STRING,
-        **kwargs,
+        host: str = REDIS_HOST,
+        port: int = REDIS_PORT,
+        password: Optional[str] = REDIS_PASSWORD,
+        db: int = REDIS_DB,
+        connection_string: Optional[str] = REDIS_CONNECTION_STRING,
+        key: str = REDIS_KEY,
+        connection_pool: Optional[ConnectionPool] = None,
+        **kwargs: Any,
     ):
         """
         init redis client
@@ -39,9 +74,14 @@ class RedisClient:
         :param port: redis port
         :param password: redis password
         :param connection_string: redis connection_string
+        :param key: key of sorted set of proxies, other keys are derived from it
+        :param connection_pool: pool shared with another client, args of
+            connection are ignored if set
         """
+        if connection_pool:
+            pool = connection_pool
         # if set connection_string, just use it
-        if connection_string:
+        elif connection_string:
             pool = ConnectionPool.from_url(
                 connection_string, decode_responses=True, **kwargs
             )
@@ -56,103 +96,506 @@ class RedisClient:
                 **kwargs,
             )
         self.db = Redis(connection_pool=pool)
+        self.key = key
+        # next test time of proxies, their average latency, success streak
+        # and failures reported by clients
+        self.schedule_key = f"{key}:schedule"
+        self.latency_key = f"{key}:latency"
+        self.streak_key = f"{key}:streak"
+        self.failure_key = f"{key}:failures"
+        # new proxies waiting to be tested before they are served
+        self.staging_key = f"{key}:staging"
+        # expire of leases, proxy of leases and number of leases of proxies
+        self.lease_key = f"{key}:leases"
+        self.lease_proxy_key = f"{key}:leases:proxy"
+        self.load_key = f"{key}:load"
+        # pub/sub channel of events, like the pool dropping below PROXY_NUMBER_MIN
+        self.event_key = f"{key}:events"
+        # clients of named pools
+        self.pools: Dict[str, RedisClient] = {}
+        self.ingest_script = self.db.register_script(INGEST_SCRIPT)
+        self.stage_script = self.db.register_script(STAGE_SCRIPT)
+        self.sample_script = self.db.register_script(SAMPLE_SCRIPT)
+        self.page_script = self.db.register_script(PAGE_SCRIPT)
+        self.fastest_script = self.db.register_script(FASTEST_SCRIPT)
+        self.record_script = self.db.register_script(RECORD_SCRIPT)
+        self.expire_script = self.db.register_script(EXPIRE_SCRIPT)
+        self.claim_script = self.db.register_script(CLAIM_SCRIPT)
+        self.reschedule_script = self.db.register_script(RESCHEDULE_SCRIPT)
+        self.checkout_script = self.db.register_script(CHECKOUT_SCRIPT)
+        self.release_script = self.db.register_script(RELEASE_SCRIPT)
+        self.report_script = self.db.register_script(REPORT_SCRIPT)
 
-    async def add(
-        self, proxy: Proxy, deduction: int = DEDUCTION_EXPIRATION_TIME
-    ) -> int:
+    @REDIS_SECONDS.timed("batch_add")
+    async def batch_add(
+        self, proxy_list: List[Proxy], deduction: int = DEDUCTION_EXPIRATION_TIME
+    ) -> IngestResult:
         """
-        add proxy and set it to init expire
-        :param proxy: proxy, ip:port
+        batch add proxy and set it to init expire,
+        invalid proxies are rejected, duplicates keep the latest expire,
+        expire of existing proxies is only extended,
+        written in pipelined chunks of REDIS_BATCH_SIZE
+        :param proxy_list: List[Proxy], ip:port
         :param deduction: Deduction of expiration time
-        :return:
-            0 exist
-            1 not exist
+        :return: numbers of added, updated and rejected proxies
         """
-        if not is_valid_proxy(f"{proxy.host}:{proxy.port}"):
-            logger.info(f"invalid proxy {proxy}, throw it")
-            return 0
-        return await self.db.zadd(REDIS_KEY, {proxy.string(): proxy.expire - deduction})
+        return await self._ingest(
+            proxy_list, deduction, self.ingest_script, [self.key, self.schedule_key]
+        )
 
-    async def batch_add(
+    @REDIS_SECONDS.timed("stage")
+    async def stage(
         self, proxy_list: List[Proxy], deduction: int = DEDUCTION_EXPIRATION_TIME
-    ) -> int:
+    ) -> IngestResult:
         """
-        batch add proxy and set it to init expire
+        batch stage new proxies to be tested before they are served,
+        validated like batch_add, expire of served proxies is extended at once
         :param proxy_list: List[Proxy], ip:port
         :param deduction: Deduction of expiration time
-        :return:
-            0 all exist
-            n  n do not exist
-        """
-        valid_proxy_list = []
-        for proxy in proxy_list:
-            if not is_valid_proxy(f"{proxy.host}:{proxy.port}"):
-                logger.info(f"invalid proxy {proxy}, throw it")
-            valid_proxy_list.append(proxy)
-        if valid_proxy_list:
-            return await self.db.zadd(
-                REDIS_KEY,
-                {
-                    proxy.string(): proxy.expire - deduction
-                    for proxy in valid_proxy_list
-                },
-            )
-        return 0
+        :return: numbers of newly staged, updated and rejected proxies
+        """
+        return await self._ingest(
+            proxy_list, deduction, self.stage_script, [self.key, self.staging_key]
+        )
+
+    async def _ingest(
+        self,
+        proxy_list: List[Proxy],
+        deduction: int,
+        script: AsyncScript,
+        keys: List[str],
+    ) -> IngestResult:
+        """
+        validate and dedupe proxies, then run script on them in pipelined chunks
+        :param proxy_list: List[Proxy], ip:port
+        :param deduction: Deduction of expiration time
+        :param script: script returning {added, updated} of a chunk
+        :param keys: keys of script
+        :return: numbers of added, updated and rejected proxies
+        """
+        expires, rejected = latest_expires(proxy_list, deduction)
+        result = IngestResult(rejected=rejected)
+        if not expires:
+            return result
+        items = list(expires.items())
+        async with self.db.pipeline(transaction=False) as pipe:
+            for i in range(0, len(items), REDIS_BATCH_SIZE):
+                args: List[Union[str, int]] = []
+                for member, expire in items[i : i + REDIS_BATCH_SIZE]:
+                    args.extend((member, expire))
+                await script(keys=keys, args=args, client=pipe)
+            for added, updated in await pipe.execute():
+                result.added += added
+                result.updated += updated
+        return result
+
+    async def staged(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        pop staged proxies in chunks, latest expire first, a popped proxy is
+        not staged any more so it is tested once, expired ones are dropped
+        :param count: max chunk size
+        :return: chunks of proxies
+        """
+        while True:
+            data = await self.db.zpopmax(self.staging_key, count)
+            now = int(time.time())
+            if proxies := convert_proxies(
+                [item for item in data if item[1] >= now], trusted=True
+            ):
+                yield proxies
+            if len(data) < count:
+                return
 
-    async def random(self) -> Proxy:
+    @REDIS_SECONDS.timed("sample")
+    async def sample(
+        self, count: int = 1, min_ttl: int = 0, strategy: str = "random"
+    ) -> List[Proxy]:
         """
-        get random proxy
-        firstly try to get proxy with max score
-        if not exists, try to get proxy by rank
-        if not exists, raise error
-        :return: proxy, like 8.8.8.8:8
+        get distinct random proxies
+        random: pick random ranks among proxies which are not expired,
+            random numbers are passed in as lua math.random is seeded on every call
+        fastest: pick among max(RANDOM_CANDIDATES, count) live proxies with the
+            lowest latency
+        weighted: same candidates as fastest, weighted by 1 / latency
+        fall back to random if no latency is recorded
+        :param count: max number of proxies
+        :param min_ttl: min seconds proxies must stay alive
+        :param strategy: random, fastest or weighted
+        :return: list of proxies, less than count if the pool is short
         """
-        # try to get proxy with max score
-        proxies = await self.db.zrangebyscore(
-            REDIS_KEY, int(time.time()), "+inf", withscores=True
+        if strategy != "random" and (
+            candidates := await self.fastest(max(RANDOM_CANDIDATES, count), min_ttl)
+        ):
+            if strategy == "weighted":
+                # weighted sampling without replacement, keep the largest keys
+                # u ** (1 / weight) compared as log(u) * latency, which keeps
+                # the order while u ** latency underflows to 0 for slow proxies
+                candidates.sort(key=lambda item: log(1 - random()) * max(item[1], 1))
+                return [proxy for proxy, _ in candidates[-count:]]
+            return [
+                proxy for proxy, _ in sample(candidates, min(count, len(candidates)))
+            ]
+        data = await self.sample_script(
+            keys=[self.key],
+            args=[int(time.time()) + min_ttl, *(random() for _ in range(count))],
+        )
+        return convert_proxies(
+            [(data[i], float(data[i + 1])) for i in range(0, len(data), 2)],
+            trusted=True,
         )
-        if len(proxies):
-            return convert_proxy(choice(proxies))
-        raise PoolEmptyException
 
-    async def delete(self, proxy: Proxy) -> int:
+    @REDIS_SECONDS.timed("fastest")
+    async def fastest(
+        self, number: int = RANDOM_CANDIDATES, min_ttl: int = 0
+    ) -> List[Tuple[Proxy, float]]:
         """
-        delete proxy, if small
-        :param proxy: proxy
-        :return: new score
+        get live proxies with the lowest latency
+        :param number: max number of proxies
+        :param min_ttl: min seconds proxies must stay alive
+        :return: list of (proxy, latency in ms), fastest first
         """
-        logger.info(f"{proxy.string()} remove")
-        return await self.db.zrem(REDIS_KEY, proxy.string())
+        data = await self.fastest_script(
+            keys=[self.key, self.latency_key],
+            args=[int(time.time()) + min_ttl, number],
+        )
+        return [
+            (convert_proxy((data[i], float(data[i + 1]))), float(data[i + 2]))
+            for i in range(0, len(data), 3)
+        ]
 
+    @REDIS_SECONDS.timed("batch_delete")
+    async def batch_delete(self, proxy_list: List[Proxy]) -> int:
+        """
+        batch delete proxies, in pipelined chunks of REDIS_BATCH_SIZE
+        :param proxy_list: List[Proxy]
+        :return: number of removed proxies
+        """
+        if not proxy_list:
+            return 0
+        logger.info(f"remove {len(proxy_list)} proxies")
+        async with self.db.pipeline(transaction=False) as pipe:
+            for i in range(0, len(proxy_list), REDIS_BATCH_SIZE):
+                members = [
+                    proxy.string() for proxy in proxy_list[i : i + REDIS_BATCH_SIZE]
+                ]
+                pipe.zrem(self.key, *members)
+                pipe.zrem(self.schedule_key, *members)
+                pipe.zrem(self.latency_key, *members)
+                pipe.hdel(self.streak_key, *members)
+                pipe.hdel(self.failure_key, *members)
+            # only count removed from proxies, every fifth result
+            return sum((await pipe.execute())[::5])
+
+    @REDIS_SECONDS.timed("expired_delete")
     async def expired_delete(self) -> int:
         """
         remove expired proxy
         :return: new score
         """
         logger.info(f"remove expired proxy")
-        return await self.db.zremrangebyscore(REDIS_KEY, "-inf", int(time.time()))
+        return await self.expire_script(
+            keys=[
+                self.key,
+                self.schedule_key,
+                self.latency_key,
+                self.streak_key,
+                self.failure_key,
+                self.staging_key,
+            ],
+            args=[int(time.time())],
+        )
 
+    @REDIS_SECONDS.timed("exists")
     async def exists(self, proxy: Proxy) -> bool:
         """
         if proxy exists
         :param proxy: proxy
         :return: if exists, bool
         """
-        return not await self.db.zscore(REDIS_KEY, proxy.string()) is None
+        return not await self.db.zscore(self.key, proxy.string()) is None
 
+    @REDIS_SECONDS.timed("count")
     async def count(self) -> int:
         """
         get count of proxies
         :return: count, int
         """
-        return await self.db.zcount(REDIS_KEY, int(time.time()), "+inf")
+        return await self.db.zcount(self.key, int(time.time()), "+inf")
 
+    @REDIS_SECONDS.timed("all")
     async def all(self) -> List[Proxy]:
         """
         get all proxies
         :return: list of proxies
         """
         data = await self.db.zrangebyscore(
-            REDIS_KEY, int(time.time()), "+inf", withscores=True
+            self.key, int(time.time()), "+inf", withscores=True
+        )
+        return convert_proxies(data, trusted=True)
+
+    @REDIS_SECONDS.timed("page")
+    async def page(
+        self, cursor: Optional[str], limit: int
+    ) -> Tuple[List[Proxy], Optional[str]]:
+        """
+        get a page of live proxies ordered by expire and proxy, O(log n + limit)
+        :param cursor: cursor returned with last page, None for the first page
+        :param limit: max number of proxies
+        :return: proxies and cursor of next page, None if it is the last page
+        """
+        args: List[Union[int, str]] = [int(time.time()), limit + 1]
+        if cursor:
+            args.extend(decode_cursor(cursor))
+        # one more proxy is read to tell if this page is the last one
+        data = await self.page_script(keys=[self.key], args=args)
+        proxies = convert_proxies(
+            [(data[i], float(data[i + 1])) for i in range(0, len(data), 2)],
+            trusted=True,
+        )
+        if len(proxies) <= limit:
+            return proxies, None
+        return proxies[:limit], encode_cursor(proxies[limit - 1])
+
+    async def scan(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        iterate live proxies in chunks with ZSCAN, memory does not grow with
+        the pool, a proxy may be returned more than once
+        :param count: hint of chunk size
+        :return: chunks of proxies
+        """
+        cursor = None
+        while cursor != 0:
+            cursor, data = await self.db.zscan(self.key, cursor or 0, count=count)
+            now = int(time.time())
+            if proxies := convert_proxies(
+                [item for item in data if item[1] >= now], trusted=True
+            ):
+                yield proxies
+
+    @REDIS_SECONDS.timed("schedule_all")
+    async def schedule_all(self) -> None:
+        """
+        schedule proxies added before schedule was enabled, they are due at once
+        :return:
+        """
+        async for proxies in self.scan():
+            await self.db.zadd(
+                self.schedule_key, {proxy.string(): 0 for proxy in proxies}, nx=True
+            )
+
+    async def due(self, count: int = REDIS_BATCH_SIZE) -> AsyncIterator[List[Proxy]]:
+        """
+        claim proxies due to be tested in chunks, a claimed proxy is not due
+        again for TEST_INTERVAL_MIN so it is tested once even if never rescheduled
+        :param count: max chunk size
+        :return: chunks of proxies
+        """
+        while True:
+            now = int(time.time())
+            number, data = await self.claim_script(
+                keys=[self.key, self.schedule_key],
+                args=[now, count, now + TEST_INTERVAL_MIN],
+            )
+            if proxies := convert_proxies(
+                [(data[i], float(data[i + 1])) for i in range(0, len(data), 2)],
+                trusted=True,
+            ):
+                yield proxies
+            if number < count:
+                return
+
+    @REDIS_SECONDS.timed("record")
+    async def record(self, results: List[Tuple[Proxy, float]]) -> int:
+        """
+        record latency and success of passed proxies
+        :param results: list of (proxy, latency in ms)
+        :return: number of recorded proxies
+        """
+        if not results:
+            return 0
+        async with self.db.pipeline(transaction=False) as pipe:
+            for i in range(0, len(results), REDIS_BATCH_SIZE):
+                args: list = [TEST_LATENCY_ALPHA]
+                for proxy, latency in results[i : i + REDIS_BATCH_SIZE]:
+                    args.extend((proxy.string(), latency))
+                await self.record_script(
+                    keys=[self.key, self.latency_key, self.streak_key],
+                    args=args,
+                    client=pipe,
+                )
+            return sum(await pipe.execute())
+
+    @REDIS_SECONDS.timed("reschedule")
+    async def reschedule(self, proxy_list: List[Proxy]) -> int:
+        """
+        schedule next test of passed proxies by their success streak and ttl
+        :param proxy_list: List[Proxy]
+        :return: number of rescheduled proxies
+        """
+        if not proxy_list:
+            return 0
+        now = int(time.time())
+        async with self.db.pipeline(transaction=False) as pipe:
+            for i in range(0, len(proxy_list), REDIS_BATCH_SIZE):
+                args: list = [
+                    now,
+                    TEST_INTERVAL_MIN,
+                    TEST_INTERVAL_MAX,
+                    TEST_INTERVAL_TTL_RATIO,
+                ]
+                for proxy in proxy_list[i : i + REDIS_BATCH_SIZE]:
+                    args.extend((proxy.string(), proxy.expire))
+                await self.reschedule_script(
+                    keys=[self.schedule_key, self.streak_key], args=args, client=pipe
+                )
+            return sum(await pipe.execute())
+
+    @REDIS_SECONDS.timed("checkout")
+    async def checkout(self, ttl: int = LEASE_TTL) -> Optional[Lease]:
+        """
+        lease a random live proxy leased by less than LEASE_MAX_CONCURRENCY
+        clients, a lease not released is reaped after ttl
+        :param ttl: seconds of lease
+        :return: lease, None if no proxy is available
+        """
+        now = int(time.time())
+        lease_id = uuid.uuid4().hex
+        data = await self.checkout_script(
+            keys=[self.key, self.lease_key, self.lease_proxy_key, self.load_key],
+            args=[
+                now,
+                now + ttl,
+                lease_id,
+                LEASE_MAX_CONCURRENCY,
+                *(random() for _ in range(LEASE_CANDIDATES)),
+            ],
+        )
+        if not data:
+            return None
+        proxy, expire = data
+        return Lease(
+            id=lease_id, proxy=convert_proxy((proxy, float(expire))), expire=now + ttl
+        )
+
+    @REDIS_SECONDS.timed("release")
+    async def release(self, lease_id: str, success: Optional[bool] = None) -> bool:
+        """
+        end lease, outcome of the proxy is reported if given
+        :param lease_id: id of lease
+        :param success: if proxy worked for the client, None if not reported
+        :return: if lease existed
+        """
+        member = await self.release_script(
+            keys=[self.lease_key, self.lease_proxy_key, self.load_key],
+            args=[lease_id],
         )
-        return convert_proxies(data)
+        if not member:
+            return False
+        if success is not None:
+            await self.report(
+                [Report(proxy=convert_proxy((member, 0)), success=success)]
+            )
+        return True
+
+    @REDIS_SECONDS.timed("report")
+    async def report(self, reports: List[Report]) -> ReportResult:
+        """
+        apply outcomes reported by clients, in pipelined chunks of REDIS_BATCH_SIZE,
+        a success clears failures and defers next test, a failure makes the proxy
+        due to be tested and removes it after REPORT_FAILURE_THRESHOLD failures
+        in a row, reports of unknown proxies are ignored
+        :param reports: List[Report]
+        :return: numbers of applied reports, removed and rejected proxies
+        """
+        result = ReportResult()
+        args: list = []
+        for report in reports:
+            if not report.proxy or not is_valid_proxy(member := report.proxy.string()):
+                result.rejected += 1
+                continue
+            latency = -1 if report.latency is None else report.latency
+            args.extend((member, int(bool(report.success)), latency))
+        if not args:
+            return result
+        now = int(time.time())
+        size = REDIS_BATCH_SIZE * 3
+        async with self.db.pipeline(transaction=False) as pipe:
+            for i in range(0, len(args), size):
+                await self.report_script(
+                    keys=[
+                        self.key,
+                        self.schedule_key,
+                        self.latency_key,
+                        self.streak_key,
+                        self.failure_key,
+                    ],
+                    args=[
+                        now,
+                        REPORT_FAILURE_THRESHOLD,
+                        TEST_LATENCY_ALPHA,
+                        now + TEST_INTERVAL_MIN,
+                        *args[i : i + size],
+                    ],
+                    client=pipe,
+                )
+            for applied, removed in await pipe.execute():
+                result.applied += applied
+                result.removed += removed
+        if result.removed:
+            logger.info(f"remove {result.removed} proxies reported failed")
+            DELETED.labels("reported").inc(result.removed)
+        return result
+
+    async def clear(self) -> None:
+        """
+        remove all proxies with their schedule, stats, staging and leases
+        :return:
+        """
+        await self.db.delete(
+            self.key,
+            self.schedule_key,
+            self.latency_key,
+            self.streak_key,
+            self.failure_key,
+            self.staging_key,
+            self.lease_key,
+            self.lease_proxy_key,
+            self.load_key,
+        )
+
+    def pool(self, name: str) -> "RedisClient":
+        """
+        client of a named pool, stored like key with name as its last part,
+        e.g. proxies:google next to proxies:universal, on the same connection pool
+        :param name: name of pool
+        :return: client
+        """
+        if name not in self.pools:
+            prefix, _, _ = self.key.rpartition(":")
+            self.pools[name] = RedisClient(
+                key=f"{prefix or self.key}:{name}",
+                connection_pool=self.db.connection_pool,
+            )
+        return self.pools[name]
+
+    @REDIS_SECONDS.timed("publish")
+    async def publish(self, event: str) -> None:
+        """
+        publish event to listeners of events, in any process
+        :param event: event, like LOW_EVENT
+        :return:
+        """
+        await self.db.publish(self.event_key, event)
+
+    async def events(self) -> AsyncIterator[str]:
+        """
+        listen to published events on a connection of its own until closed
+        :return: events
+        """
+        pubsub = self.db.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.event_key)
+        try:
+            async for message in pubsub.listen():
+                yield message["data"]
+        finally:
+            await pubsub.close()
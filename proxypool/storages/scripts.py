@@ -0,0 +1,319 @@
+"""
+lua scripts of redis storage, random numbers are always passed in as ARGV
+because lua math.random is seeded the same on every call
+"""
+
+# pick distinct live proxies by rank, one for each random float, a rank
+# picked twice moves to the next free one, ZCOUNT and ZRANGE are both
+# O(log n) so the cost does not grow with the pool size
+# KEYS[1]: proxies
+# ARGV[1]: min live score, ARGV[2...]: floats in [0, 1)
+# return: {proxy, expire, proxy, expire, ...}
+SAMPLE_SCRIPT = """
+local expired = redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[1])
+local live = redis.call('ZCARD', KEYS[1]) - expired
+local result = {}
+local picked = {}
+for i = 2, math.min(#ARGV, live + 1) do
+    local rank = math.floor(tonumber(ARGV[i]) * live)
+    while picked[rank] do
+        rank = (rank + 1) % live
+    end
+    picked[rank] = true
+    local item = redis.call(
+        'ZRANGE', KEYS[1], expired + rank, expired + rank, 'WITHSCORES'
+    )
+    result[#result + 1] = item[1]
+    result[#result + 1] = item[2]
+end
+return result
+"""
+
+# page of live proxies after the (expire, proxy) of cursor, in (score, member)
+# order of the sorted set, so proxies removed meanwhile do not shift pages,
+# members of the same score are binary searched as they are ordered by bytes
+# KEYS[1]: proxies
+# ARGV[1]: min live score, ARGV[2]: number of proxies to return,
+# ARGV[3]: expire of cursor, ARGV[4]: proxy of cursor, none for the first page
+PAGE_SCRIPT = """
+local start = redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[1])
+if ARGV[3] then
+    local lo = redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[3])
+    local hi = lo + redis.call('ZCOUNT', KEYS[1], ARGV[3], ARGV[3])
+    while lo < hi do
+        local mid = math.floor((lo + hi) / 2)
+        if redis.call('ZRANGE', KEYS[1], mid, mid)[1] <= ARGV[4] then
+            lo = mid + 1
+        else
+            hi = mid
+        end
+    end
+    start = math.max(start, lo)
+end
+return redis.call('ZRANGE', KEYS[1], start, start + ARGV[2] - 1, 'WITHSCORES')
+"""
+
+# upsert proxies, an existing proxy only has its expire extended, never
+# shortened, new proxies are due to be tested at once
+# KEYS[1]: proxies, KEYS[2]: schedule
+# ARGV: proxy, expire, proxy, expire, ...
+# return: {number of added, number of updated}
+INGEST_SCRIPT = """
+local added = 0
+local updated = 0
+for i = 1, #ARGV, 2 do
+    local member = ARGV[i]
+    local expire = tonumber(ARGV[i + 1])
+    local current = redis.call('ZSCORE', KEYS[1], member)
+    if not current then
+        redis.call('ZADD', KEYS[1], expire, member)
+        redis.call('ZADD', KEYS[2], 'NX', 0, member)
+        added = added + 1
+    elseif expire > tonumber(current) then
+        redis.call('ZADD', KEYS[1], expire, member)
+        updated = updated + 1
+    end
+end
+return {added, updated}
+"""
+
+# pick up to ARGV[2] live proxies with the lowest latency
+# KEYS[1]: proxies, KEYS[2]: latency
+# ARGV[1]: min live score, ARGV[2]: max number
+# return: {proxy, expire, latency, proxy, expire, latency, ...}
+FASTEST_SCRIPT = """
+local now = tonumber(ARGV[1])
+local number = tonumber(ARGV[2])
+local fastest = redis.call('ZRANGE', KEYS[2], 0, number * 4 - 1, 'WITHSCORES')
+local result = {}
+for i = 1, #fastest, 2 do
+    local expire = redis.call('ZSCORE', KEYS[1], fastest[i])
+    if expire and tonumber(expire) >= now then
+        result[#result + 1] = fastest[i]
+        result[#result + 1] = expire
+        result[#result + 1] = fastest[i + 1]
+        if #result >= number * 3 then
+            break
+        end
+    end
+end
+return result
+"""
+
+# stage new proxies to be tested before they are served, a proxy already
+# served only has its expire extended, a staged one keeps the latest expire
+# KEYS[1]: proxies, KEYS[2]: staging
+# ARGV: proxy, expire, proxy, expire, ...
+# return: {number of newly staged, number of updated}
+STAGE_SCRIPT = """
+local added = 0
+local updated = 0
+for i = 1, #ARGV, 2 do
+    local member = ARGV[i]
+    local expire = tonumber(ARGV[i + 1])
+    local current = redis.call('ZSCORE', KEYS[1], member)
+    if current then
+        if expire > tonumber(current) then
+            redis.call('ZADD', KEYS[1], expire, member)
+            updated = updated + 1
+        end
+    else
+        local staged = redis.call('ZSCORE', KEYS[2], member)
+        if not staged then
+            redis.call('ZADD', KEYS[2], expire, member)
+            added = added + 1
+        elseif expire > tonumber(staged) then
+            redis.call('ZADD', KEYS[2], expire, member)
+        end
+    end
+end
+return {added, updated}
+"""
+
+# remove expired proxies together with their schedule and stats, and
+# expired staged proxies
+# KEYS[1]: proxies, KEYS[2]: schedule, KEYS[3]: latency, KEYS[4]: streak,
+# KEYS[5]: failures, KEYS[6]: staging
+# ARGV[1]: max expired score
+EXPIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[6], '-inf', ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for i = 1, #expired, 1000 do
+    local chunk = {unpack(expired, i, math.min(i + 999, #expired))}
+    redis.call('ZREM', KEYS[2], unpack(chunk))
+    redis.call('ZREM', KEYS[3], unpack(chunk))
+    redis.call('HDEL', KEYS[4], unpack(chunk))
+    redis.call('HDEL', KEYS[5], unpack(chunk))
+end
+return redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+"""
+
+# claim proxies due to be tested by moving them to ARGV[3] in schedule, so
+# they are not claimed twice, proxies which are gone or expired are unscheduled
+# KEYS[1]: proxies, KEYS[2]: schedule
+# ARGV[1]: now, ARGV[2]: max number, ARGV[3]: score of claimed ones
+# return: {number of due proxies, {proxy, expire, proxy, expire, ...}}
+CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, ARGV[2])
+local claimed = {}
+for _, member in ipairs(due) do
+    local expire = redis.call('ZSCORE', KEYS[1], member)
+    if expire and tonumber(expire) >= now then
+        redis.call('ZADD', KEYS[2], ARGV[3], member)
+        claimed[#claimed + 1] = member
+        claimed[#claimed + 1] = expire
+    else
+        redis.call('ZREM', KEYS[2], member)
+    end
+end
+return {#due, claimed}
+"""
+
+# record passed proxies which still exist, latency is averaged as
+# old + (new - old) * alpha and success streak is increased
+# KEYS[1]: proxies, KEYS[2]: latency, KEYS[3]: streak
+# ARGV[1]: alpha, ARGV[2...]: proxy, latency, proxy, latency, ...
+RECORD_SCRIPT = """
+local alpha = tonumber(ARGV[1])
+local recorded = 0
+for i = 2, #ARGV, 2 do
+    local member = ARGV[i]
+    if redis.call('ZSCORE', KEYS[1], member) then
+        local latency = tonumber(ARGV[i + 1])
+        local old = redis.call('ZSCORE', KEYS[2], member)
+        if old then
+            latency = tonumber(old) + (latency - tonumber(old)) * alpha
+        end
+        redis.call('ZADD', KEYS[2], latency, member)
+        redis.call('HINCRBY', KEYS[3], member, 1)
+        recorded = recorded + 1
+    end
+end
+return recorded
+"""
+
+# schedule next test of passed proxies, interval doubles with the success
+# streak between min and max, and is capped by a ratio of the remaining ttl
+# KEYS[1]: schedule, KEYS[2]: streak
+# ARGV[1]: now, ARGV[2]: min interval, ARGV[3]: max interval, ARGV[4]: ttl ratio
+# ARGV[5...]: proxy, expire, proxy, expire, ...
+RESCHEDULE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local min = tonumber(ARGV[2])
+local max = tonumber(ARGV[3])
+local ratio = tonumber(ARGV[4])
+local scheduled = 0
+for i = 5, #ARGV, 2 do
+    local member = ARGV[i]
+    if redis.call('ZSCORE', KEYS[1], member) then
+        local streak = tonumber(redis.call('HGET', KEYS[2], member) or 1)
+        local interval = math.min(min * 2 ^ (streak - 1), max)
+        local remain = (tonumber(ARGV[i + 1]) - now) * ratio
+        interval = math.min(interval, math.max(remain, min))
+        redis.call('ZADD', KEYS[1], 'XX', math.floor(now + interval), member)
+        scheduled = scheduled + 1
+    end
+end
+return scheduled
+"""
+
+# reap expired leases, then lease the first of the random live proxies which
+# has less than ARGV[4] active leases
+# KEYS[1]: proxies, KEYS[2]: leases, KEYS[3]: proxy of leases, KEYS[4]: load
+# ARGV[1]: now, ARGV[2]: lease expire, ARGV[3]: lease id,
+# ARGV[4]: max leases of a proxy, ARGV[5...]: floats in [0, 1)
+# return: {proxy, expire}, nil if no proxy is available
+CHECKOUT_SCRIPT = """
+local reaped = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 1000)
+for _, id in ipairs(reaped) do
+    local member = redis.call('HGET', KEYS[3], id)
+    if member then
+        if tonumber(redis.call('ZINCRBY', KEYS[4], -1, member)) <= 0 then
+            redis.call('ZREM', KEYS[4], member)
+        end
+        redis.call('HDEL', KEYS[3], id)
+    end
+    redis.call('ZREM', KEYS[2], id)
+end
+local expired = redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[1])
+local live = redis.call('ZCARD', KEYS[1]) - expired
+if live <= 0 then
+    return nil
+end
+for i = 5, #ARGV do
+    local rank = expired + math.floor(tonumber(ARGV[i]) * live)
+    local item = redis.call('ZRANGE', KEYS[1], rank, rank, 'WITHSCORES')
+    local load = tonumber(redis.call('ZSCORE', KEYS[4], item[1]) or 0)
+    if load < tonumber(ARGV[4]) then
+        redis.call('ZINCRBY', KEYS[4], 1, item[1])
+        redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+        redis.call('HSET', KEYS[3], ARGV[3], item[1])
+        return item
+    end
+end
+return nil
+"""
+
+# end a lease
+# KEYS[1]: leases, KEYS[2]: proxy of leases, KEYS[3]: load
+# ARGV[1]: lease id
+# return: proxy of the lease, nil if lease is unknown or expired
+RELEASE_SCRIPT = """
+local member = redis.call('HGET', KEYS[2], ARGV[1])
+if not member then
+    return nil
+end
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[1], ARGV[1])
+if tonumber(redis.call('ZINCRBY', KEYS[3], -1, member)) <= 0 then
+    redis.call('ZREM', KEYS[3], member)
+end
+return member
+"""
+
+# apply reports of clients to proxies which still exist, a success clears
+# failures, averages latency if given and defers next test to ARGV[4], a
+# failure makes the proxy due to be tested and removes it after ARGV[2] ones
+# KEYS[1]: proxies, KEYS[2]: schedule, KEYS[3]: latency, KEYS[4]: streak,
+# KEYS[5]: failures
+# ARGV[1]: now, ARGV[2]: failure threshold, ARGV[3]: alpha, ARGV[4]: next test,
+# ARGV[5...]: proxy, success (1 or 0), latency (negative if unknown), ...
+# return: {number of applied reports, number of removed proxies}
+REPORT_SCRIPT = """
+local threshold = tonumber(ARGV[2])
+local alpha = tonumber(ARGV[3])
+local applied, removed = 0, 0
+for i = 5, #ARGV, 3 do
+    local member = ARGV[i]
+    if redis.call('ZSCORE', KEYS[1], member) then
+        applied = applied + 1
+        if ARGV[i + 1] == '1' then
+            redis.call('HDEL', KEYS[5], member)
+            local latency = tonumber(ARGV[i + 2])
+            if latency >= 0 then
+                local old = redis.call('ZSCORE', KEYS[3], member)
+                if old then
+                    latency = tonumber(old) + (latency - tonumber(old)) * alpha
+                end
+                redis.call('ZADD', KEYS[3], latency, member)
+            end
+            local due = redis.call('ZSCORE', KEYS[2], member)
+            if due and tonumber(due) < tonumber(ARGV[4]) then
+                redis.call('ZADD', KEYS[2], ARGV[4], member)
+            end
+        elseif redis.call('HINCRBY', KEYS[5], member, 1) >= threshold then
+            redis.call('ZREM', KEYS[1], member)
+            redis.call('ZREM', KEYS[2], member)
+            redis.call('ZREM', KEYS[3], member)
+            redis.call('HDEL', KEYS[4], member)
+            redis.call('HDEL', KEYS[5], member)
+            removed = removed + 1
+        else
+            redis.call('HDEL', KEYS[4], member)
+            redis.call('ZADD', KEYS[2], 'XX', ARGV[1], member)
+        end
+    end
+end
+return {applied, removed}
+"""
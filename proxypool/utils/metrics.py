@@ -0,0 +1,363 @@
+"""
+metrics of proxypool in prometheus text format, kept in process, updating
+one is a dict lookup and an addition so they stay on in hot paths
+"""
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Coroutine,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    ParamSpec,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from aiohttp import web
+from loguru import logger
+
+# latency buckets in seconds, from a local redis round trip to a slow proxy
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Value:
+    """
+    value of a counter or gauge, read from function if set
+    """
+
+    __slots__ = ("value", "function")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        read value from function when rendered, for values kept elsewhere
+        """
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+
+class HistogramValue:
+    """
+    value of a histogram, counts are per bucket and summed when rendered
+    """
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        # the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """
+        observe seconds spent in the block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+V = TypeVar("V")
+T = TypeVar("T")
+P = ParamSpec("P")
+
+
+class Metric(ABC, Generic[V]):
+    """
+    metric with optional labels, values of each label values are kept apart
+    """
+
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional[List["Metric[Any]"]] = None,
+    ):
+        """
+        init metric and register it
+        :param name: name of metric
+        :param documentation: help of metric
+        :param labelnames: names of labels
+        :param registry: registry to render metric with, REGISTRY if not set
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], V] = {}
+        # metric without labels is rendered even if never updated
+        if not self.labelnames:
+            self.labels()
+        (REGISTRY if registry is None else registry).append(self)
+
+    @abstractmethod
+    def new_value(self) -> V:
+        """
+        value of new label values
+        """
+
+    def labels(self, *values: str) -> V:
+        """
+        get value of label values, created on first use
+        :param values: values of labels, in order of labelnames
+        :return: value
+        """
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_value()
+        return child
+
+    def label_pairs(self, values: Tuple[str, ...], **extra: str) -> str:
+        pairs = [*zip(self.labelnames, values), *extra.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{escape(str(v))}"' for k, v in pairs) + "}"
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, child in list(self.children.items()):
+            yield from self.samples(values, child)
+
+    @abstractmethod
+    def samples(self, values: Tuple[str, ...], child: V) -> Iterator[str]:
+        """
+        lines of value of label values
+        """
+
+
+class ValueMetric(Metric[Value]):
+    """
+    metric of a single number for each label values
+    """
+
+    def new_value(self) -> Value:
+        return Value()
+
+    def samples(self, values: Tuple[str, ...], child: Value) -> Iterator[str]:
+        yield f"{self.name}{self.label_pairs(values)} {child.get()}"
+
+
+class Counter(ValueMetric):
+    """
+    value only goes up
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+
+class Gauge(ValueMetric):
+    """
+    value goes up and down
+    """
+
+    type = "gauge"
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+
+class Histogram(Metric[HistogramValue]):
+    """
+    distribution of values in buckets
+    """
+
+    type = "histogram"
+
+    def __init__(self, *args: Any, buckets: Sequence[float] = BUCKETS, **kwargs: Any):
+        self.buckets = tuple(buckets)
+        super().__init__(*args, **kwargs)
+
+    def new_value(self) -> HistogramValue:
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> ContextManager[None]:
+        return self.labels().time()
+
+    def timed(
+        self, *values: str
+    ) -> Callable[
+        [Callable[P, Coroutine[Any, Any, T]]], Callable[P, Coroutine[Any, Any, T]]
+    ]:
+        """
+        decorate coroutine function to observe seconds of each call
+        :param values: values of labels
+        :return: decorator
+        """
+        child = self.labels(*values)
+
+        def decorator(
+            function: Callable[P, Coroutine[Any, Any, T]]
+        ) -> Callable[P, Coroutine[Any, Any, T]]:
+            @wraps(function)
+            async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def samples(self, values: Tuple[str, ...], child: HistogramValue) -> Iterator[str]:
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+            total += count
+            labels = self.label_pairs(values, le=str(bound))
+            yield f"{self.name}_bucket{labels} {total}"
+        yield f"{self.name}_sum{self.label_pairs(values)} {child.sum}"
+        yield f"{self.name}_count{self.label_pairs(values)} {total}"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+REGISTRY: List[Metric[Any]] = []
+
+
+def render(registry: Optional[List[Metric[Any]]] = None) -> str:
+    """
+    render metrics in prometheus text format
+    :param registry: metrics to render, REGISTRY if not set
+    :return: text
+    """
+    return (
+        "\n".join(
+            line
+            for metric in (REGISTRY if registry is None else registry)
+            for line in metric.render()
+        )
+        + "\n"
+    )
+
+
+# prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+TESTS = Counter("proxypool_tests_total", "proxies tested", ["result"])
+POOL_TESTS = Counter(
+    "proxypool_pool_tests_total",
+    "proxies tested against url of pools",
+    ["pool", "result"],
+)
+TEST_SECONDS = Histogram(
+    "proxypool_test_seconds", "latency of test url through valid proxies"
+)
+TESTER_CYCLE_SECONDS = Gauge(
+    "proxypool_tester_cycle_seconds", "duration of last tester cycle"
+)
+GETTER_CYCLE_SECONDS = Gauge(
+    "proxypool_getter_cycle_seconds", "duration of last getter cycle"
+)
+CRAWLED = Counter(
+    "proxypool_crawled_total", "proxies crawled, new since last fetch", ["crawler"]
+)
+FETCHES = Counter(
+    "proxypool_fetches_total",
+    "source urls fetched by result, changed, unchanged or not_modified",
+    ["result"],
+)
+INGESTED = Counter(
+    "proxypool_ingested_total",
+    "crawled proxies by result, added, staged, updated or rejected",
+    ["result"],
+)
+DELETED = Counter(
+    "proxypool_deleted_total",
+    "proxies removed, invalid, expired or reported",
+    ["reason"],
+)
+POOL_SIZE = Gauge("proxypool_pool_size", "live proxies in pool")
+REDIS_SECONDS = Histogram(
+    "proxypool_redis_seconds", "round trips of redis storage", ["operation"]
+)
+API_SECONDS = Histogram("proxypool_api_seconds", "latency of api requests", ["path"])
+CACHE_SIZE = Gauge("proxypool_cache_size", "proxies in server cache")
+CACHE_HITS = Counter("proxypool_cache_hits_total", "requests served by cache")
+CACHE_MISSES = Counter("proxypool_cache_misses_total", "requests cache missed")
+CACHE_REFRESH_SECONDS = Gauge(
+    "proxypool_cache_refresh_seconds", "duration of last cache refresh"
+)
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """
+    expose /metrics of this process with aiohttp, a port that cannot be bound
+    is logged and skipped, metrics are not worth stopping the process
+    :param host: host to listen on
+    :param port: port to listen on
+    :return: runner, clean it up to stop, None if not bound
+    """
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=render().encode(), headers={"Content-Type": CONTENT_TYPE}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.error(f"failed to serve metrics on {host}:{port}, {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"metrics served on http://{host}:{port}/metrics")
+    return runner
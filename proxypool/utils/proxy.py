@@ -1,46 +1,66 @@
+import re
+from typing import Iterable, List, Tuple
+
 from proxypool.schemas import Proxy
 
+# octet of 0-255, leading zeros allowed as before
+OCTET = r"0*(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)"
+IP_PATTERN = re.compile(rf"(?:{OCTET}\.){{3}}{OCTET}", re.ASCII)
+PROXY_PATTERN = re.compile(rf"(?:{OCTET}\.){{3}}{OCTET}(?::\d+)?", re.ASCII)
+
 
 def is_valid_proxy(data):
     """
     check this string is within proxy format
     """
-    if data.__contains__(":"):
-        ip = data.split(":")[0]
-        port = data.split(":")[1]
-        return is_ip_valid(ip) and is_port_valid(port)
-    else:
-        return is_ip_valid(data)
+    return PROXY_PATTERN.fullmatch(data) is not None
+
+
+def filter_valid_proxies(proxy_list: Iterable[Proxy]) -> List[Tuple[str, int]]:
+    """
+    keep proxies which are within proxy format and have an expire
+    :param proxy_list: proxies to validate
+    :return: list of (host:port, expire)
+    """
+    match = PROXY_PATTERN.fullmatch
+    result = []
+    for proxy in proxy_list:
+        member = proxy.string()
+        if proxy.expire is not None and match(member):
+            result.append((member, proxy.expire))
+    return result
 
 
 def is_ip_valid(ip):
     """
     check this string is within ip format
     """
-    a = ip.split(".")
-    if len(a) != 4:
-        return False
-    for x in a:
-        if not x.isdigit():
-            return False
-        i = int(x)
-        if i < 0 or i > 255:
-            return False
-    return True
+    return IP_PATTERN.fullmatch(ip) is not None
 
 
 def is_port_valid(port):
     return port.isdigit()
 
 
-def convert_proxies(data):
+def convert_proxies(data, trusted=False):
     """
     convert list of tuple(proxy,expire) to valid proxies
     :param data:
+    :param trusted: data was validated when written, skip validation,
+        only items which can not be converted at all are skipped
     :return:
     """
     if not data:
         return []
+    if trusted:
+        result = []
+        for proxy, expire in data:
+            host, _, port = proxy.rpartition(":")
+            try:
+                result.append(Proxy(host, int(port), int(expire)))
+            except ValueError:
+                continue
+        return result
     result = []
     for proxy_tuple in data:
         if proxy := convert_proxy(proxy_tuple):
@@ -59,7 +79,7 @@ def convert_proxy(data):
     (proxy, expire) = data
     # skip invalid item
     proxy = proxy.strip()
-    if not is_valid_proxy(proxy):
+    if not PROXY_PATTERN.fullmatch(proxy) or ":" not in proxy:
         return
     host, port = proxy.split(":")
     return Proxy(host=host, port=int(port), expire=int(expire))
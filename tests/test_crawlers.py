@@ -0,0 +1,96 @@
+"""
+urls are fetched conditionally and unchanged responses are skipped, but only
+once proxies of the last response are saved
+
+    pytest tests
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import pytest
+
+from proxypool.crawlers import base
+from proxypool.schemas import Proxy
+
+PAGE = "10.0.0.1:8000\n10.0.0.2:8000"
+
+
+class Response:
+    def __init__(self, status: int, headers: Dict[str, str], text: str) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = text
+
+    async def text(self) -> str:
+        return self.body
+
+
+class Crawler(base.BaseCrawler):
+    urls = ["url"]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.page = PAGE
+        self.etag = '"1"'
+        self.conditions: List[Optional[str]] = []
+
+    @asynccontextmanager
+    async def request(self, url: str, **kwargs: Any) -> AsyncIterator[Any]:
+        # Response stands in for aiohttp.ClientResponse
+        etag = kwargs["headers"].get("If-None-Match")
+        self.conditions.append(etag)
+        if etag == self.etag:
+            yield Response(304, {}, "")
+        else:
+            yield Response(200, {"ETag": self.etag}, self.page)
+
+    def parse(self, html: str) -> List[Proxy]:
+        proxies = []
+        for line in html.split():
+            host, port = line.split(":")
+            proxies.append(Proxy(host=host, port=int(port)))
+        return proxies
+
+
+@pytest.fixture
+def crawler(monkeypatch: pytest.MonkeyPatch) -> Crawler:
+    monkeypatch.setattr(base, "ENABLE_INCREMENTAL_CRAWL", True)
+    return Crawler()
+
+
+def strings(proxies: List[Proxy]) -> List[str]:
+    return [proxy.string() for proxy in proxies]
+
+
+@pytest.mark.anyio
+async def test_not_modified(crawler):
+    assert strings(await crawler.crawl("url")) == PAGE.split()
+    crawler.commit("url")
+    assert await crawler.crawl("url") == []
+    assert crawler.conditions == [None, '"1"']
+
+
+@pytest.mark.anyio
+async def test_unchanged_and_new(crawler):
+    await crawler.crawl("url")
+    crawler.commit("url")
+    crawler.etag = '"2"'
+    assert await crawler.crawl("url") == []
+    crawler.commit("url")
+    crawler.etag = '"3"'
+    crawler.page = f"{PAGE}\n10.0.0.3:8000"
+    assert strings(await crawler.crawl("url")) == ["10.0.0.3:8000"]
+
+
+@pytest.mark.anyio
+async def test_fetched_in_full_until_committed(crawler):
+    await crawler.crawl("url")
+    # proxies failed to save, nothing is committed
+    assert strings(await crawler.crawl("url")) == PAGE.split()
+    assert crawler.conditions == [None, None]
+
+
+@pytest.mark.anyio
+async def test_iteration_commits_previous_url(crawler):
+    assert [strings(proxies) async for proxies in crawler] == [PAGE.split()]
+    assert [proxies async for proxies in crawler] == [[]]
@@ -0,0 +1,64 @@
+"""
+getter runs less often while the pool is healthy, but soon enough to save
+crawled proxies again before they expire, and at once when the pool drains
+
+    pytest tests
+"""
+import asyncio
+import time
+
+import pytest
+
+from proxypool.crawlers.base import BaseCrawler, Source
+from proxypool.processors import getter as getter_module
+from proxypool.setting import DEDUCTION_EXPIRATION_TIME, PROXY_NUMBER_MIN
+from proxypool.storages.memory import MemoryClient
+
+
+@pytest.fixture
+def getter(monkeypatch: pytest.MonkeyPatch) -> getter_module.Getter:
+    monkeypatch.setattr(getter_module, "GETTER_BACKOFF_MAX", 8)
+    monkeypatch.setattr(getter_module, "CRAWLER_TIMEOUT", 60)
+    getter = getter_module.Getter(MemoryClient())
+    getter.crawlers = []
+    getter.count = PROXY_NUMBER_MIN
+    return getter
+
+
+def test_delay_backs_off_while_healthy(getter):
+    assert [getter.delay(10) for _ in range(5)] == [10, 20, 40, 80, 80]
+    getter.count = PROXY_NUMBER_MIN - 1
+    assert getter.delay(10) == 10
+    getter.count = PROXY_NUMBER_MIN
+    assert getter.delay(10) == 10
+
+
+def test_delay_stops_before_crawled_proxies_expire(getter):
+    crawler = BaseCrawler()
+    source = Source()
+    source.update(b"digest", set(), time.time() + 180 + DEDUCTION_EXPIRATION_TIME)
+    crawler._sources = {"url": source}
+    getter.crawlers = [crawler]
+    assert getter.delay(100) == 100
+    # saved again a run before they expire in storage in 180s
+    assert getter.delay(100) == pytest.approx(120, abs=1)
+    getter.deadline = time.time() + 100
+    assert getter.delay(100) == 100
+
+
+@pytest.mark.anyio
+async def test_wait_cut_short_when_pool_drains(getter, monkeypatch):
+    monkeypatch.setattr(getter_module, "GETTER_COOLDOWN", 0.05)
+    asyncio.get_running_loop().call_later(0.1, getter.low.set)
+    start = time.perf_counter()
+    await getter.wait(5)
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.anyio
+async def test_wait_ignores_low_while_pool_is_low(getter):
+    getter.count = PROXY_NUMBER_MIN - 1
+    asyncio.get_running_loop().call_later(0.05, getter.low.set)
+    start = time.perf_counter()
+    await getter.wait(0.3)
+    assert time.perf_counter() - start >= 0.3
@@ -0,0 +1,82 @@
+"""
+endpoints of the api on the memory storage, skipped if httpx is not installed
+
+    pytest tests
+"""
+import time
+from typing import Any, AsyncIterator, List
+
+import pytest
+
+from proxypool.processors import server
+from proxypool.schemas import Proxy
+from proxypool.setting import REPORT_FAILURE_THRESHOLD
+from proxypool.storages.memory import MemoryClient
+
+httpx = pytest.importorskip("httpx")
+
+
+@pytest.fixture
+async def storage(monkeypatch: pytest.MonkeyPatch) -> MemoryClient:
+    storage = MemoryClient()
+    expire = int(time.time()) + 600
+    proxies = [Proxy(host=f"10.0.0.{i}", port=8000, expire=expire) for i in range(5)]
+    await storage.batch_add(proxies, 0)
+    monkeypatch.setattr(server, "get_conn", lambda: storage)
+    return storage
+
+
+@pytest.fixture
+async def client(storage: MemoryClient) -> AsyncIterator[Any]:
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
+
+
+@pytest.mark.anyio
+async def test_lease_and_release(client):
+    assert (await client.get("/lease")).status_code == 405
+    response = await client.post("/lease", params={"ttl": 10})
+    assert response.status_code == 200
+    lease = response.json()
+    assert lease["proxy"].startswith("10.0.0.")
+    params = {"lease": lease["lease"], "success": True}
+    assert (await client.post("/release", params=params)).json() == {"released": True}
+    assert (await client.post("/release", params=params)).json() == {"released": False}
+
+
+@pytest.mark.anyio
+async def test_lease_from_empty_pool(client, storage):
+    await storage.clear()
+    assert (await client.post("/lease")).status_code == 503
+
+
+@pytest.mark.anyio
+async def test_report(client, storage):
+    reports = [{"proxy": "10.0.0.1:8000", "success": False}] * REPORT_FAILURE_THRESHOLD
+    response = await client.post(
+        "/report", json=reports + [{"proxy": "bad", "success": True}]
+    )
+    assert response.json() == {
+        "applied": REPORT_FAILURE_THRESHOLD,
+        "removed": 1,
+        "rejected": 1,
+    }
+    assert (await client.get("/count")).json() == 4
+
+
+@pytest.mark.anyio
+async def test_all_in_pages(client):
+    proxies: List[str] = []
+    params = {"limit": 2}
+    while True:
+        page = (await client.get("/all", params=params)).json()
+        proxies.extend(f"{proxy['host']}:{proxy['port']}" for proxy in page["proxies"])
+        if not page["cursor"]:
+            break
+        params["cursor"] = page["cursor"]
+    assert sorted(proxies) == [f"10.0.0.{i}:8000" for i in range(5)]
+    response = await client.get("/all", params={"limit": 2, "cursor": "bad"})
+    assert response.status_code == 400
+    text = (await client.get("/all", params={"format": "text"})).text
+    assert sorted(text.split()) == sorted(proxies)
@@ -0,0 +1,137 @@
+"""
+both storages must behave the same, every test runs against the memory
+storage and the redis storage on fakeredis, skipped if it or lupa is not
+installed
+
+    pytest tests
+"""
+import time
+from typing import AsyncIterator, List
+
+import pytest
+
+from proxypool.schemas import IngestResult, Proxy, Report
+from proxypool.setting import LEASE_MAX_CONCURRENCY, REPORT_FAILURE_THRESHOLD
+from proxypool.storages.base import BaseStorage
+from proxypool.storages.memory import MemoryClient
+from proxypool.storages.redis import RedisClient
+
+
+@pytest.fixture(params=["memory", "redis"])
+def storage(request: pytest.FixtureRequest) -> BaseStorage:
+    if request.param == "memory":
+        return MemoryClient()
+    fakeredis = pytest.importorskip("fakeredis")
+    # scripts of the redis storage run on lua of fakeredis
+    pytest.importorskip("lupa")
+    db = fakeredis.FakeAsyncRedis(decode_responses=True)
+    return RedisClient(key="proxies:test", connection_pool=db.connection_pool)
+
+
+def proxies(number: int, ttl: int = 600, start: int = 0) -> List[Proxy]:
+    expire = int(time.time()) + ttl
+    return [
+        Proxy(host=f"10.0.0.{i}", port=8000, expire=expire)
+        for i in range(start, start + number)
+    ]
+
+
+async def collect(chunks: AsyncIterator[List[Proxy]]) -> List[str]:
+    return [proxy.string() async for chunk in chunks for proxy in chunk]
+
+
+@pytest.mark.anyio
+async def test_batch_add_only_extends_expire(storage):
+    proxy = proxies(1)[0]
+    assert await storage.batch_add([proxy], 0) == IngestResult(added=1)
+    shorter = Proxy(host=proxy.host, port=proxy.port, expire=proxy.expire - 100)
+    assert await storage.batch_add([shorter], 0) == IngestResult()
+    longer = Proxy(host=proxy.host, port=proxy.port, expire=proxy.expire + 100)
+    assert await storage.batch_add([longer, shorter], 0) == IngestResult(updated=1)
+    assert [p.expire for p in await storage.all()] == [proxy.expire + 100]
+
+
+@pytest.mark.anyio
+async def test_batch_add_rejects_invalid(storage):
+    expire = int(time.time()) + 600
+    result = await storage.batch_add(
+        [
+            Proxy(host="10.0.0.256", port=80, expire=expire),
+            Proxy(host="example.com", port=80, expire=expire),
+            Proxy(host="10.0.0.1", port=80, expire=None),
+            Proxy(host="10.0.0.2", port=80, expire=expire),
+        ],
+        0,
+    )
+    assert result == IngestResult(added=1, rejected=3)
+    assert await storage.count() == 1
+
+
+@pytest.mark.anyio
+async def test_sample_distinct_and_min_ttl(storage):
+    await storage.batch_add(proxies(5, ttl=30) + proxies(5, ttl=600, start=5), 0)
+    sampled = await storage.sample(20)
+    assert len(sampled) == 10
+    assert len({proxy.string() for proxy in sampled}) == 10
+    long_lived = await storage.sample(20, min_ttl=300)
+    assert sorted(proxy.string() for proxy in long_lived) == sorted(
+        proxy.string() for proxy in proxies(5, start=5)
+    )
+    assert len(await storage.sample(3)) == 3
+
+
+@pytest.mark.anyio
+async def test_due_and_reschedule(storage):
+    added = proxies(5)
+    await storage.batch_add(added, 0)
+    # new proxies are due at once, a claimed proxy is not due again
+    assert sorted(await collect(storage.due())) == sorted(p.string() for p in added)
+    assert await collect(storage.due()) == []
+    assert await storage.reschedule(added) == 5
+    assert await collect(storage.due()) == []
+
+
+@pytest.mark.anyio
+async def test_stage_and_staged(storage):
+    served = proxies(1)[0]
+    await storage.batch_add([served], 0)
+    longer = Proxy(host=served.host, port=served.port, expire=served.expire + 100)
+    new = proxies(3, start=1)
+    # served proxies have their expire extended instead of being staged
+    assert await storage.stage(new + [longer], 0) == IngestResult(added=3, updated=1)
+    assert await storage.stage(new, 0) == IngestResult()
+    assert await storage.count() == 1
+    assert sorted(await collect(storage.staged())) == sorted(p.string() for p in new)
+    assert await collect(storage.staged()) == []
+
+
+@pytest.mark.anyio
+async def test_checkout_and_release(storage):
+    await storage.batch_add(proxies(1), 0)
+    leases = [await storage.checkout() for _ in range(LEASE_MAX_CONCURRENCY)]
+    assert all(leases)
+    assert await storage.checkout() is None
+    assert await storage.release(leases[0].id)
+    assert not await storage.release(leases[0].id)
+    assert (await storage.checkout()).proxy.string() == leases[0].proxy.string()
+
+
+@pytest.mark.anyio
+async def test_report_threshold(storage):
+    failing, flaky = proxies(2)
+    await storage.batch_add([failing, flaky], 0)
+    for _ in range(REPORT_FAILURE_THRESHOLD - 1):
+        result = await storage.report([Report(proxy=failing, success=False)])
+        assert (result.applied, result.removed) == (1, 0)
+    result = await storage.report([Report(proxy=failing, success=False)])
+    assert (result.applied, result.removed) == (1, 1)
+    assert not await storage.exists(failing)
+    # a success clears failures so far
+    reports = [Report(proxy=flaky, success=False)] * (REPORT_FAILURE_THRESHOLD - 1)
+    await storage.report(reports + [Report(proxy=flaky, success=True, latency=50)])
+    await storage.report(reports)
+    assert await storage.exists(flaky)
+    result = await storage.report(
+        [Report(proxy=Proxy(host="10.0.0.256", port=80), success=False)]
+    )
+    assert result.rejected == 1
@@ -0,0 +1,63 @@
+"""
+staged proxies popped by a test run that does not finish are staged again
+
+    pytest tests
+"""
+import asyncio
+import time
+from typing import AsyncIterator, List
+
+import pytest
+
+from proxypool.processors import tester as tester_module
+from proxypool.schemas import Proxy
+from proxypool.storages.memory import MemoryClient
+
+
+def proxies(number: int) -> List[Proxy]:
+    expire = int(time.time()) + 600
+    return [Proxy(host=f"10.0.0.{i}", port=8000, expire=expire) for i in range(number)]
+
+
+@pytest.fixture
+async def tester(monkeypatch: pytest.MonkeyPatch) -> tester_module.Tester:
+    monkeypatch.setattr(tester_module, "TEST_ANONYMOUS", False)
+    tester = tester_module.Tester(MemoryClient())
+
+    async def test(proxy: Proxy, *args: object) -> None:
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(tester, "test", test)
+    await tester.storage.stage(proxies(20), 0)
+    return tester
+
+
+async def staged(tester: tester_module.Tester) -> List[str]:
+    return sorted(
+        [proxy.string() async for chunk in tester.storage.staged() for proxy in chunk]
+    )
+
+
+@pytest.mark.anyio
+async def test_restage_on_cancel(tester):
+    task = asyncio.create_task(
+        tester.test_all((tester.storage.staged(count=5), True), workers=2)
+    )
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await staged(tester) == sorted(proxy.string() for proxy in proxies(20))
+
+
+@pytest.mark.anyio
+async def test_restage_on_error(tester):
+    async def broken() -> AsyncIterator[List[Proxy]]:
+        async for chunk in tester.storage.staged(count=3):
+            yield chunk
+            raise ConnectionError
+
+    with pytest.raises(ConnectionError):
+        await tester.test_all((broken(), True), workers=2)
+    # the chunk popped before the error is staged again with the rest
+    assert await staged(tester) == sorted(proxy.string() for proxy in proxies(20))